@@ -1,16 +1,16 @@
 """Produces files for klusta clustering from rhd files."""
 import os
 import sys
-import read_rhd as rhd
-import numpy as np
+import conversion_manifest
 import glob
 from shutil import copy2
 
-def RHDtoDATprbPRM(dataPath,basename,probefile):
+def RHDtoDATprbPRM(dataPath,basename,probefile,num_workers=None):
 	"""dataPath is a string that points to the folder containing RHD files.
 	basename is the common string that this program will use to generate new .dat and .kwik files.
 	probefile is a string describing the probe; currently, 'A1x32-Poly2-5mm-50s-177-A32.prb' , 'Buzsaki32.prb' , and 
 	'ASSY-37W-DBC11A-intan.prb' are accepted.
+	num_workers is the number of files converted at once; None uses one worker per CPU.
 	"""
 	if probefile != 'A1x32-Poly2-5mm-50s-177-A32.prb' and probefile != 'Buzsaki32.prb' and probefile != 'ASSY-37W-DBC11A-intan.prb':
 		print('Probe file is not valid')
@@ -31,22 +31,11 @@ def RHDtoDATprbPRM(dataPath,basename,probefile):
 	files = glob.glob('*.rhd')
 	files.sort(key=os.path.getmtime)
 	
-	for file in files:
-		d = rhd.read_rhd(file)
-		recordings = np.transpose(d['amplifier_data'])
-		stimulation = ()
-		#save amplifier data as .dat
-		recordings.tofile(os.path.splitext(file)[0] +'.dat')
-		#save digital input streams
-		for digitalChannel in range(d['board_dig_in_data'].shape[0]):
-			d['board_dig_in_data'][digitalChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(digitalChannel) + '.di')
-		if len(d['aux_input_data']) != 0:
-			for analogChannel in range(d['aux_input_data'].shape[0]):
-				d['aux_input_data'][analogChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(analogChannel) + '.ai')
+	# convert new or changed files in parallel; each worker writes its own .dat, .di and .ai files
+	metadata = conversion_manifest.update_folder('.', files, num_workers)
 
 	#create .prm file and copy .prb file to data directory
-	datFiles = glob.glob('*.dat')
-	datFiles.sort(key=os.path.getmtime)
+	datFiles = [m['dat_file'] for m in metadata] # same order as the .rhd files
 	
 	# copy .prb files to dataPath
 	copy2(kwikToolsPath+'/'+probefile,dataPath)
@@ -57,8 +46,8 @@ def RHDtoDATprbPRM(dataPath,basename,probefile):
 		text_file.write('traces = dict( \n')
 		text_file.write('\traw_data_files={0},\n'.format(datFiles))
 		text_file.write('\tvoltage_gain={0}.0,\n'.format(192))  #from Intan RHD2000 documentation
-		text_file.write('\tsample_rate={0},\n'.format(d['frequency_parameters']['amplifier_sample_rate']))
-		text_file.write('\tn_channels={0},\n'.format(len(d['amplifier_channels'])))
+		text_file.write('\tsample_rate={0},\n'.format(metadata[-1]['sample_rate']))
+		text_file.write('\tn_channels={0},\n'.format(metadata[-1]['num_channels']))
 		text_file.write('\tdtype=\'uint16\'\n')
 		text_file.write('\t)\n\n')
 		
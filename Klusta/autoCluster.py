@@ -1,49 +1,50 @@
 import findNewRecordings
 import RHDtoDATprbPRM
 import os
-import subprocess
 import datetime
+import job_runner
 
-def autoCluster():
+INDEX_FILE = findNewRecordings.getIndexFile('autoCluster')
+
+def autoCluster(max_workers=None, timeout=None):
+	"""Clusters every new recording found by findNewRecordings that has no .kwik file yet.
+	
+	The klusta runs are started as subprocesses, at most max_workers at once (None runs one per CPU),
+	each killed after timeout seconds (None waits for it to finish).
+	Returns the results from job_runner.run_jobs.
+	"""
 	
 	dt = datetime.datetime.now()
+	logFile = 'C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt'
 	
-	origDir = os.getcwd() #making sure to keep python in original directory if changing directory
-	workingPaths = findNewRecordings.findNewRecordings() #get the paths that are written within the last day.
+	workingPaths, newIndex = findNewRecordings.findNewRecordings(indexFile=INDEX_FILE) #get the paths that are written within the last day.
 	print(workingPaths)
-	## writing a .bat file called tempBAT with instructions for clustering
-	with open('C:\\users\\Alan\\Documents\\Github\\clustering-pipelines\\tempBAT.bat','w+') as f:
-		f.write('@echo off\n')
-		f.write('title temp bat for clustering\n')
 	
+	jobs = []
+	jobPaths = []
+	done = []
 	for path, basename in workingPaths:
 		if not (os.path.isfile(path+'/'+basename+'.kwik')):
 			print(path)
-			#sendString = 'cd '+str(path)+';ls'#activate phy; klusta '+str(basename)+'.prm'
-			#print(sendString)
-			#subprocess.call(['activate phy'],shell=True, cwd=path) #,'activate phy','klusta '+basename+'.prm'],shell=True)
-			print(path)
-			print(path[path.find('HarveyLab'):])
-			with open('C:\\users\\Alan\\Documents\\Github\\clustering-pipelines\\tempBAT.bat','a+') as f:
-				f.write('pushd \\\\research.files.med.harvard.edu\\Neurobio\n') #creates temporary directory where drive letter starts at Neurobio
-				f.write('cd '+path[path.find('HarveyLab'):]+'\n')
-				f.write('klusta '+basename+'.prm\n')
-				f.write('popd\n') # escape temp directory
-			with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a+') as f2:
-				f2.write('New clustering performed.\nFile: '+path+'\\'+basename+'.kwik\n')
+			jobs.append(job_runner.make_job(path+'\\'+basename, ['klusta', basename+'.prm'], cwd=path, timeout=timeout)) # runs klusta in the recording folder, no pushd needed
+			jobPaths.append(path)
 		else:
 			print('already clustered')
+			done.append(path)
 
-			with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a+') as f2:
+			with open(logFile,'a+') as f2:
 				f2.write('Clustering was performed previously.\nFile: '+path+'\\'+basename+'.kwik\n')
-			
-	with open('C:\\users\\Alan\\Documents\\Github\\clustering-pipelines\\tempBAT.bat','a+') as f:
-		#f.write('@echo off\n')
-		#f.write('deactivate\n') #deactivate the phy environment
-		f.write('exit\n')
-		
-	p = subprocess.Popen('C:\\users\\Alan\\Documents\\Github\\clustering-pipelines\\tempBAT.bat',shell=True) #run the tempBat file.
-	stdout, stderr = p.communicate()
+	
+	results = job_runner.run_jobs(jobs, max_workers)
+	with open(logFile,'a+') as f2:
+		for result in results:
+			f2.write('New clustering performed: %s.\nFile: %s.kwik\nRuntime: %0.1f seconds\n' % (result['status'], result['name'], result['runtime']))
+			if result['status'] != 'ok':
+				f2.write(result['stderr'][-2000:]+'\n') # end of the error output of failed runs
+	# failed runs are left out of the index, so the next run tries them again
+	done += [path for path, result in zip(jobPaths, results) if result['status'] == 'ok']
+	findNewRecordings.commitRecordings(INDEX_FILE, newIndex, workingPaths, done)
+	return results
 
 def main():
 	autoCluster()
@@ -1,14 +1,23 @@
 import findNewRecordings
 import RHDtoDATprbPRM
+import conversion_manifest
 import os
 import datetime
+import traceback
+
+INDEX_FILE = findNewRecordings.getIndexFile('autoExtract')
 
 def autoExtract():
-	workingPaths = findNewRecordings.findNewRecordings()
+	workingPaths, newIndex = findNewRecordings.findNewRecordings(indexFile=INDEX_FILE)
+	done = []
 	for path, basename in workingPaths:
 		print(path, basename)
-		if not(os.path.isfile(path+'/'+basename+'.prm')):
-			RHDtoDATprbPRM.RHDtoDATprbPRM(path, basename, 'A1x32-Poly2-5mm-50s-177-A32.prb') # 'ASSY-37W-DBC11A-intan.prb' this is Brendan's edge probe from Cambridge Neurotech
+		if not(os.path.isfile(path+'/'+basename+'.prm')) or conversion_manifest.pending_files(path):
+			try:
+				RHDtoDATprbPRM.RHDtoDATprbPRM(path, basename, 'A1x32-Poly2-5mm-50s-177-A32.prb') # 'ASSY-37W-DBC11A-intan.prb' this is Brendan's edge probe from Cambridge Neurotech
+			except Exception:
+				traceback.print_exc() # left out of the index, so the next run tries it again
+				continue
 			# hard coded the poly2 probe for now. This could be improved in the future: 'A1x32-Poly2-5mm-50s-177-A32.prb'
 			dt = datetime.datetime.now()
 			with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
@@ -18,6 +27,8 @@ def autoExtract():
 			dt = datetime.datetime.now()
 			with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
 				f2.write('Extraction was performed previously.\n')
+		done.append(path)
+	findNewRecordings.commitRecordings(INDEX_FILE, newIndex, workingPaths, done)
 
 def main():
 	autoExtract()
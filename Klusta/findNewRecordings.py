@@ -1,36 +1,108 @@
-import os, sys, time, datetime, glob
-from stat import S_ISREG, ST_CTIME, ST_MODE
-
-def findNewRecordings():
-	
-	#serverDir = r'Z:\HarveyLab\Alan\Data' # map your network drive before running, can do so by typing 'net use Z: \\research.files.med.harvard.edu\Neurobio' into cmd
-	serverDir = r'\\research.files.med.harvard.edu\Neurobio\HarveyLab\Alan\Data' #use this and pushd/popd to access the server
-	
-	entries = (os.path.join(serverDir, fn) for fn in os.listdir(serverDir))
-	entries = ((os.stat(path),path) for path in entries)
-	entries = ((stat[ST_CTIME], path) for stat, path in entries)
-    
-	entries2 = []
-	for cdate, path in sorted(entries):
-		if cdate > (time.time() - (1*3600*24)): # find and extract directories less than 1 day old
-			entries2.append((cdate, path))
-
-	origDir = os.getcwd()
-	dirList = []
-	for cdate, path in entries2:
-		os.chdir(path)
-		for subdir, dirs, files in os.walk(path):
-			for x in files:
-				if x.endswith('.rhd'):
-					#basename = x[:x.find('_')] ## use this to extract the first part of the filenamme as the basename
-					basename = os.path.basename(subdir) ## use this to extract the folder as the basename rather than the filename
-					
-					if (subdir, basename) not in dirList:
-						dirList.append((subdir, basename))
-	
-	os.chdir(origDir)
+import os, time, json
+
+#SERVER_DIR = r'Z:\HarveyLab\Alan\Data' # map your network drive before running, can do so by typing 'net use Z: \\research.files.med.harvard.edu\Neurobio' into cmd
+SERVER_DIR = r'\\research.files.med.harvard.edu\Neurobio\HarveyLab\Alan\Data' #use this and pushd/popd to access the server
+
+# directories and .rhd files seen by previous scans, so unchanged ones are not listed again;
+# every script processing the recordings keeps its own, see getIndexFile
+INDEX_FILE = os.path.join(os.path.expanduser('~'), 'findNewRecordings_index.json')
+INDEX_VERSION = 1
+
+def getIndexFile(consumer):
+	"""Returns the index file of the script consumer (e.g. 'autoExtract'), next to INDEX_FILE."""
+	return os.path.join(os.path.dirname(INDEX_FILE), 'findNewRecordings_%s_index.json' % consumer)
+
+def findNewRecordings(serverDir=SERVER_DIR, indexFile=INDEX_FILE, maxAge=1*3600*24):
+	"""Returns (folder, basename) for every folder under serverDir whose .rhd files are new or changed since the last commit, and the new index.
+
+	Only top-level directories created or modified within maxAge seconds are searched (1 day by default).
+	A directory whose modification time still matches the index (and is older than maxAge) is not listed again;
+	its subdirectories are still checked, one stat each.  The index is kept in indexFile but not saved here:
+	once the folders are processed, pass the ones that succeeded to commitRecordings, so the others are listed again.
+	"""
+	index = loadIndex(indexFile)
+	dirList, newIndex = scanRecordings(serverDir, index, time.time() - maxAge)
 	for d in dirList: print(d)
-	return dirList
+	return dirList, newIndex
+
+def commitRecordings(indexFile, newIndex, dirList, done):
+	"""Saves newIndex from findNewRecordings to indexFile, leaving out the folders of dirList not in done.
+
+	done lists the folders processed successfully; the others have no entry and are listed again by the next scan.
+	"""
+	failed = set(path for path, basename in dirList) - set(done)
+	saveIndex(indexFile, {path: entry for path, entry in newIndex.items() if path not in failed})
+
+def scanRecordings(serverDir, index, cutoff):
+	"""Scans the top-level directories of serverDir created or modified after cutoff (seconds since the epoch).
+
+	index maps directory paths to what a previous scan found in them.
+	Returns the list of (folder, basename) with new or changed .rhd files and the updated index.
+	"""
+	with os.scandir(serverDir) as it:
+		topDirs = [(entry.path, entry.stat()) for entry in it if entry.is_dir()]
+
+	cutoffNs = int(cutoff * 1e9)
+	recent = sorted((max(st.st_ctime, st.st_mtime), path, st.st_mtime_ns) for path, st in topDirs if max(st.st_ctime, st.st_mtime) > cutoff)
+
+	# keep the entries of directories that were not scanned this time
+	scanned = tuple(path for cdate, path, mtimeNs in recent)
+	newIndex = {path: entry for path, entry in index.items() if not any(path == top or path.startswith(top + os.sep) for top in scanned)}
+
+	dirList = []
+	for cdate, path, mtimeNs in recent:
+		scanDirectory(path, mtimeNs, index, newIndex, cutoffNs, dirList)
+	return dirList, newIndex
+
+def scanDirectory(path, mtimeNs, index, newIndex, cutoffNs, dirList):
+	"""Records directory path (modified at mtimeNs) and its subdirectories in newIndex, adding changed folders to dirList."""
+	entry = index.get(path)
+	if entry is not None and entry['mtime_ns'] == mtimeNs and mtimeNs < cutoffNs:
+		# no file was added, removed or renamed here since the last scan
+		rhdFiles = entry['rhd']
+		subdirs = []
+		for name in entry['subdirs']:
+			try:
+				subdirs.append((name, os.stat(os.path.join(path, name)).st_mtime_ns))
+			except OSError:
+				pass
+	else:
+		rhdFiles = {}
+		subdirs = []
+		with os.scandir(path) as it:
+			for x in it:
+				if x.is_dir():
+					subdirs.append((x.name, x.stat().st_mtime_ns))
+				elif x.name.endswith('.rhd'):
+					st = x.stat()
+					rhdFiles[x.name] = [st.st_size, st.st_mtime_ns]
+		old = entry['rhd'] if entry is not None else {}
+		if any(old.get(name) != info for name, info in rhdFiles.items()):
+			#basename = x[:x.find('_')] ## use this to extract the first part of the filenamme as the basename
+			basename = os.path.basename(path) ## use this to extract the folder as the basename rather than the filename
+			dirList.append((path, basename))
+
+	newIndex[path] = {'mtime_ns': mtimeNs, 'subdirs': [name for name, subdirMtimeNs in subdirs], 'rhd': rhdFiles}
+	for name, subdirMtimeNs in subdirs:
+		scanDirectory(os.path.join(path, name), subdirMtimeNs, index, newIndex, cutoffNs, dirList)
+
+def loadIndex(indexFile):
+	"""Returns the index saved by the last scan, or an empty one."""
+	try:
+		with open(indexFile, 'r') as f:
+			index = json.load(f)
+		if index.get('index_version') == INDEX_VERSION:
+			return index['dirs']
+	except (IOError, OSError, ValueError, KeyError):
+		pass
+	return {}
+
+def saveIndex(indexFile, index):
+	"""Writes the index, replacing the old one only once the new one is complete."""
+	tmpFile = indexFile + '.tmp'
+	with open(tmpFile, 'w') as f:
+		json.dump({'index_version': INDEX_VERSION, 'dirs': index}, f)
+	os.replace(tmpFile, indexFile)
 
 def get_information(directory):
     file_list = []
@@ -38,9 +110,10 @@ def get_information(directory):
         a = os.stat(os.path.join(directory,i))
         file_list.append([i,time.ctime(a.st_atime),time.ctime(a.st_ctime)]) #[file,most_recent_access,created]
     return file_list
-	
+
 def main():
-	findNewRecordings()
+	dirList, newIndex = findNewRecordings()
+	commitRecordings(INDEX_FILE, newIndex, dirList, [path for path, basename in dirList])
 
 if __name__ == '__main__':
-	main()	
\ No newline at end of file
+	main()
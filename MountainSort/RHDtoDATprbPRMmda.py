@@ -1,19 +1,19 @@
 """Produces files for klusta and mountainsort clustering from rhd files."""
 import os
 import sys
-import read_rhd as rhd
-import numpy as np
+import conversion_manifest
 import glob
 from shutil import copy2
 import datetime
-import subprocess
+import job_runner
 
-def RHDtoDATprbPRM(dataPath,basename,probe=None):
+def RHDtoDATprbPRM(dataPath,basename,probe=None,num_workers=None):
     """dataPath is a string that points to the folder containing RHD files.
     basename is the common string that this program will use to generate new .dat and .kwik files.
     probefile is a string describing the probe; currently, 'A1x32-Poly2-5mm-50s-177-A32.prb' , 'Buzsaki32.prb' , and 
     'ASSY-37W-DBC11A-intan.prb' are accepted.
     This function also generates a raw.dat file in the subfolder alldata that can be used for mda conversion and mountainsort.
+    num_workers is the number of files converted at once; None uses one worker per CPU.
     """
     if probe is not None and probe is not 'poly2':
         raise('probe is not valid')
@@ -31,22 +31,13 @@ def RHDtoDATprbPRM(dataPath,basename,probe=None):
     files = glob.glob('*.rhd')
     files.sort(key=os.path.getmtime) ## sort files by modification time
     
-    for file in files:
-        d = rhd.read_rhd(file)
-        recordings = np.transpose(d['amplifier_data'])
-        stimulation = ()
-        #save amplifier data as .dat
-        recordings.tofile(os.path.splitext(file)[0] +'.dat')
-        #save digital input streams
-        for digitalChannel in range(d['board_dig_in_data'].shape[0]):
-            d['board_dig_in_data'][digitalChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(digitalChannel) + '.di')
-        if len(d['aux_input_data']) != 0:
-            for analogChannel in range(d['aux_input_data'].shape[0]):
-                d['aux_input_data'][analogChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(analogChannel) + '.ai')
+    # convert new or changed files in parallel; each worker writes its own .dat, .di and .ai files,
+    # and all recordings are written (or appended) to alldata/raw.dat without concatenating them in memory,
+    # their digital, aux, ADC inputs and timestamps to alldata/session.h5
+    metadata = conversion_manifest.update_folder('.', files, num_workers, concatenated=['alldata/raw.dat', 'alldata/session.h5'])
 
     #create .prm file and copy .prb file to data directory
-    datFiles = glob.glob('*.dat')
-    datFiles.sort(key=os.path.getmtime)
+    datFiles = [m['dat_file'] for m in metadata] # same order as the .rhd files
     
     # copy .prb files to dataPath
     copy2(clusteringPath+'/'+probefile,dataPath)
@@ -57,8 +48,8 @@ def RHDtoDATprbPRM(dataPath,basename,probe=None):
         text_file.write('traces = dict( \n')
         text_file.write('\traw_data_files={0},\n'.format(datFiles))
         text_file.write('\tvoltage_gain={0}.0,\n'.format(192))  #from Intan RHD2000 documentation
-        text_file.write('\tsample_rate={0},\n'.format(d['frequency_parameters']['amplifier_sample_rate']))
-        text_file.write('\tn_channels={0},\n'.format(len(d['amplifier_channels'])))
+        text_file.write('\tsample_rate={0},\n'.format(metadata[-1]['sample_rate']))
+        text_file.write('\tn_channels={0},\n'.format(metadata[-1]['num_channels']))
         text_file.write('\tdtype=\'uint16\'\n')
         text_file.write('\t)\n\n')
         
@@ -92,16 +83,8 @@ def RHDtoDATprbPRM(dataPath,basename,probe=None):
         text_file.write('\tnum_starting_clusters=100,\n')
         text_file.write(')\n')
     
-    allData = np.array([])
-    numFiles = len(datFiles)
-    for i, file in enumerate(datFiles):
-        print('on file',i,'of',numFiles)
-        allData = np.concatenate((allData, np.fromfile(file)))
-    if not os.path.exists(dataPath+'/allData'):
-        os.mkdir(dataPath+'/alldata')
-    
-    allData.tofile(dataPath+'/alldata/raw.dat')
-    print('use this as second dimension when converting to mda file using mdaconvert',int(len(allData)/8))
+    numSamples = sum(m['num_samples'] for m in metadata)
+    print('use this as second dimension when converting to mda file using mdaconvert',numSamples)
     
     dt = datetime.datetime.now()
     yearMonthDay =     dt.strftime('%Y%m%d')  
@@ -179,6 +162,8 @@ def runUbuntuShell(UbuntuShell):
     UbuntuShell is str with linux style directory of shell file
         this directory is returned from the writeUbuntuShell function
     For alan, that is something like /media/sf_UbuntuShare/DATE/DATABASE/shelltorun.sh
+    
+    Returns: stdout and stderr of the run
     '''
     with open('ubuntuRun.bat','w+') as file:
         ## change directory to that with share folder
@@ -191,8 +176,8 @@ def runUbuntuShell(UbuntuShell):
         file.write('call %s guestproperty wait "Ubuntu" RDONLYHOST\n' %(pathToVBOXmanage))
         ## executes the script UbuntuShell
         file.write('call %s guestcontrol "Ubuntu" run --username alan --password 123ubuntubox --exe %s\n' % (pathToVBOXmanage, UbuntuShell))
-    p = subprocess.Popen('ubuntuRun.bat',shell=True) #run the BAT file.
-    stdout, stderr = p.communicate()
+    result = job_runner.run_job(job_runner.make_job('ubuntuRun.bat', 'ubuntuRun.bat', shell=True)) #run the BAT file.
+    return result['stdout'], result['stderr']
     
     
 def main():
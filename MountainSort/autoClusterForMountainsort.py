@@ -1,11 +1,25 @@
 import findNewRecordings
 import mountainsort
+import conversion_manifest
 import os
 import datetime
+import traceback
+import job_runner
 
-def autoCluster():
-    workingPaths = findNewRecordings.findNewRecordings()
+INDEX_FILE = findNewRecordings.getIndexFile('autoClusterForMountainsort')
+
+def autoCluster(max_workers=None, timeout=None):
+    '''
+    Prepares every new recording found by findNewRecordings and sorts them, at most max_workers at once
+    (None runs one per CPU), each killed after timeout seconds (None waits for it to finish).
+    
+    Returns: results from job_runner.run_jobs
+    '''
+    workingPaths, newIndex = findNewRecordings.findNewRecordings(indexFile=INDEX_FILE)
     dt = datetime.datetime.now()
+    jobs = []
+    jobPaths = []
+    done = []
     
     if len(workingPaths) == 0:
         with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
@@ -13,16 +27,32 @@ def autoCluster():
     
     for path, basename in workingPaths:
         print(path, basename)
-        if not(os.path.isfile(path+'/alldata/raw.mda')):
-            mountainsort.prepFiles(path, basename, 'poly2') # This is 'A1x32-Poly2-5mm-50s-177-A32' -- hard-coded
-            
-            with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
-                f2.write('New clustering performed: %s %s.\n' % (path, basename))
+        if not(os.path.isfile(path+'/alldata/raw.mda')) or conversion_manifest.pending_files(path, dat=False):
+            try:
+                job = mountainsort.prepFiles(path, basename, 'poly2', run=False) # This is 'A1x32-Poly2-5mm-50s-177-A32' -- hard-coded
+            except Exception:
+                traceback.print_exc() # left out of the index, so the next run tries it again
+                with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
+                    f2.write('Preparing %s failed:\n%s' % (path, traceback.format_exc()))
+                continue
+            job['timeout'] = timeout
+            jobs.append(job)
+            jobPaths.append(path)
         else:
             print('already extracted')
             dt = datetime.datetime.now()
             with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
                 f2.write('Extraction was performed previously.\n')
+            done.append(path)
+    
+    results = job_runner.run_jobs(jobs, max_workers)
+    with open('C:\\DATA\\autoClusterLogs\\log'+dt.strftime('%Y%m%d')+'.txt','a') as f2:
+        for result in results:
+            f2.write('New clustering performed: %s %s in %0.1f seconds.\n' % (result['name'], result['status'], result['runtime']))
+    # failed runs are left out of the index, so the next run tries them again
+    done += [path for path, result in zip(jobPaths, results) if result['status'] == 'ok']
+    findNewRecordings.commitRecordings(INDEX_FILE, newIndex, workingPaths, done)
+    return results
 
 def main():
     autoCluster()
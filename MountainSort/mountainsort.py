@@ -1,19 +1,18 @@
 """Produces files for mountainsort clustering from rhd files."""
 import os
 import sys
-sys.path.append('C:\\Users\\Alan\\Documents\\GitHub\\mountainlab\\packages\\mlpy\\mda')
-import mdaio
-import read_rhd as rhd
-import numpy as np
+import conversion_manifest
 import glob
 from shutil import copy2
 import datetime
-import subprocess
+import job_runner
 
-def prepFiles(dataPath,basename,probe=None):
+def prepFiles(dataPath,basename,probe=None,run=True):
     """dataPath is a string that points to the folder containing RHD files.
     basename is the common string that this program will use to generate files related to the sorting project.
     probe is a string describing the probe; currently, 'poly2' and None are accepted
+    run runs the sorting on the Ubuntu virtualbox and returns its job_runner result; with run=False the job is
+    returned instead, so the sorting of several recordings can be run together with job_runner.run_jobs.
     This function generates a raw.mda file in a allData folder that will be the raw input to mountainsort.
     """
     if probe is not None and probe is not 'poly2':
@@ -32,30 +31,12 @@ def prepFiles(dataPath,basename,probe=None):
     # sort files by modification time
     files = glob.glob('*.rhd')
     files.sort(key=os.path.getmtime) ## sort files by modification time, WARNING: may be OS sensitive
-    numFiles = len(files)
     
-    
-    ## make recordings, all data organized in a num_channels X num_samples array
-    for i, file in enumerate(files):
-        print('/n/n/nExtracting file {0} of {1}: {2}\n'.format(i, numFiles, file))
-        d = rhd.read_rhd(file)
-        if i == 0:
-            recordings = d['amplifier_data']
-        else:
-            recordings = np.concatenate((recordings, d['amplifier_data']),axis=1)
-        
-        #save digital input streams
-        for digitalChannel in range(d['board_dig_in_data'].shape[0]):
-            d['board_dig_in_data'][digitalChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(digitalChannel) + '.di')
-        # save analog input streams -- kept in separate files because different recordings may have different #s of channels
-        if len(d['aux_input_data']) != 0:
-            for analogChannel in range(d['aux_input_data'].shape[0]):
-                d['aux_input_data'][analogChannel].tofile(os.path.splitext(file)[0] + 'chan' + str(analogChannel) + '.ai')
-    
-    if not os.path.exists(dataPath+'/alldata'):
-        os.mkdir(dataPath+'/alldata')
-    mdaio.writemda16ui('recordings,dataPath+/alldata/raw.mda') # write the recordings array to an mda file; will sort on uint16 array
-    del recordings
+    ## save the digital and analog input streams of each new or changed file -- kept in separate files because different recordings may have different #s of channels
+    ## and write (or append) the recordings to a uint16 mda file; will sort on uint16 array
+    ## and their digital, aux, ADC inputs and timestamps to one session file (see intanutil.session_file)
+    metadata = conversion_manifest.update_folder('.', files, dat=False, concatenated=['alldata/raw.mda', 'alldata/session.h5'])
+    numSamples = sum(m['num_samples'] for m in metadata)
     
     dt = datetime.datetime.now()
     yearMonthDay = dt.strftime('%Y%m%d')
@@ -66,30 +47,16 @@ def prepFiles(dataPath,basename,probe=None):
         os.makedirs(UbuntuSharePath)
     copy2(dataPath+'/alldata/raw.mda',UbuntuSharePath) ## oopies rwa.mda to UbuntuShare folder
     
-    allData = np.array([])
-    numFiles = len(datFiles)
-    for i, file in enumerate(datFiles):
-        print('on file',i,'of',numFiles)
-        allData = np.concatenate((allData, np.fromfile(file)))
-    if not os.path.exists(dataPath+'/allData'):
-        os.mkdir(dataPath+'/alldata')
-    
-    allData.tofile(dataPath+'/alldata/raw.dat')
-    print('use this as second dimension when converting to mda file using mdaconvert',int(len(allData)/8))
-    
-    dt = datetime.datetime.now()
-    yearMonthDay =     dt.strftime('%Y%m%d')  
-    UbuntuSharePath = 'C://Users/Alan/Desktop/UbuntuShare/'+yearMonthDay+'/'+basename+'/'
-    
-    if not os.path.exists(UbuntuSharePath):
-        os.mkdir(UbuntuSharePath)
-    copy2(dataPath+'/alldata/raw.dat',UbuntuSharePath) ## copies raw.dat to UbuntuShare folder
+    print('wrote',numSamples,'samples to raw.mda')
     
     if probe == 'poly2':
         ubuntuLocation = writeUbuntuShell(UbuntuSharePath,basename, probe='poly2')
     else:
         ubuntuLocation = writeUbuntuShell(UbuntuSharePath,basename) # assumes there are 32 channels and does not specify geometry
-    stdout,stderr = runUbuntuShell(ubuntuSharePath+'ubuntuRun.bat',ubuntuLocation)
+    job = ubuntuShellJob(UbuntuSharePath+'ubuntuRun.bat',ubuntuLocation,basename)
+    if run:
+        return job_runner.run_job(job)
+    return job
     
 def writeUbuntuShell(UbuntuSharePath,basename, probe=None, num_channels=32):
     '''
@@ -155,6 +122,17 @@ def runUbuntuShell(batFile, UbuntuShell):
     UbuntuShell is str with linux style directory of shell file
         this directory is returned from the writeUbuntuShell function
     For alan, that is something like /media/sf_UbuntuShare/DATE/DATABASE/shelltorun.sh
+    
+    Returns: stdout and stderr of the run
+    '''
+    result = job_runner.run_job(ubuntuShellJob(batFile, UbuntuShell))
+    return result['stdout'], result['stderr']
+
+def ubuntuShellJob(batFile, UbuntuShell, name=None, timeout=None):
+    '''
+    Writes batFile to run the shell file UbuntuShell (see runUbuntuShell) on the Ubuntu virtualbox
+    
+    Returns: job_runner job that runs batFile, named name (batFile by default) and killed after timeout seconds
     '''
     pathToVBOXmanage = '"C:/Program Files/Oracle/VirtualBox/VBoxManage.exe"'
     
@@ -171,9 +149,7 @@ def runUbuntuShell(batFile, UbuntuShell):
         ## executes the script UbuntuShell
         file.write('call %s guestcontrol "Ubuntu" run --username alan --password 123ubuntubox --exe %s -- --text\n' % (pathToVBOXmanage, UbuntuShell))
         
-    p = subprocess.Popen(batFile,shell=True) #run the BAT file.
-    stdout, stderr = p.communicate()
-    return stdout, stderr
+    return job_runner.make_job(name or batFile, batFile, shell=True, timeout=timeout) # runs the BAT file
     
     
 def main():
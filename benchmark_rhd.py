@@ -0,0 +1,88 @@
+#! /bin/env python
+#
+# Times the RHD2000 readers on the given files:
+#
+#   python benchmark_rhd.py [-n repeats] file1.rhd [file2.rhd ...]
+#
+# 'per block' is the original decode loop (intanutil.read_one_data_block, one data block
+# at a time); 'load_data' is the shared decode engine on its own; 'read_rhd' and 'read_data'
+# are the two entry points with their default output.
+
+import os, io, time, argparse, contextlib
+import numpy as np
+
+import read_rhd
+import read_rhd_controller
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.read_one_data_block import read_one_data_block
+from intanutil.load_data import load_data
+
+
+def read_per_block(filename):
+    """Decodes filename into raw arrays one data block at a time, as the readers used to."""
+
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        header = read_header(fid, quiet=True)
+        n = header['num_samples_per_data_block']
+        num_data_blocks = int((filesize - fid.tell()) // get_bytes_per_data_block(header))
+
+        data = {}
+        data['t_amplifier'] = np.zeros(n * num_data_blocks, dtype=np.int_)
+        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], n * num_data_blocks], dtype=np.uint)
+        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], (n // 4) * num_data_blocks], dtype=np.uint)
+        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_data_blocks], dtype=np.uint)
+        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_data_blocks], dtype=np.uint)
+        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], n * num_data_blocks], dtype=np.uint)
+        data['board_dig_in_raw'] = np.zeros(n * num_data_blocks, dtype=np.uint)
+        data['board_dig_out_raw'] = np.zeros(n * num_data_blocks, dtype=np.uint)
+
+        indices = {'amplifier': 0, 'aux_input': 0, 'supply_voltage': 0, 'board_adc': 0, 'board_dig_in': 0, 'board_dig_out': 0}
+        for i in range(num_data_blocks):
+            read_one_data_block(data, header, indices, fid)
+            indices['amplifier'] += n
+            indices['aux_input'] += n // 4
+            indices['supply_voltage'] += 1
+            indices['board_adc'] += n
+            indices['board_dig_in'] += n
+            indices['board_dig_out'] += n
+    return data
+
+
+READERS = [('per block', read_per_block),
+           ('load_data', lambda filename: load_data(filename, quiet=True)),
+           ('read_rhd', read_rhd.read_rhd),
+           ('read_data', read_rhd_controller.read_data)]
+
+
+def time_reader(reader, filename, repeats):
+    """Returns the best wall-clock time of repeats calls of reader(filename)."""
+
+    best = float('inf')
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tic = time.perf_counter()
+            reader(filename)
+            best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RHD2000 readers.')
+    parser.add_argument('-n', '--repeats', type=int, default=3, help='runs per reader; the best is reported')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    for filename in args.files:
+        with open(filename, 'rb') as fid:
+            header = read_header(fid, quiet=True)
+        megabytes = os.path.getsize(filename) / 1e6
+        print('{}: {:0.1f} MB, {} samples per data block'.format(filename, megabytes, header['num_samples_per_data_block']))
+        for name, reader in READERS:
+            seconds = time_reader(reader, filename, args.repeats)
+            print('  {:<10} {:8.3f} s  {:8.1f} MB/s'.format(name, seconds, megabytes / seconds))
+
+
+if __name__ == '__main__':
+    main()
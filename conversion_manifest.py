@@ -0,0 +1,243 @@
+"""Per-folder manifest of converted rhd files, so reruns only convert new or changed data.
+
+The manifest (conversion_manifest.json in the data folder) records for every rhd file
+its size, modification time and a content fingerprint, the metadata convert_rhd_file
+returned for it and, for each concatenated output (raw.dat, raw.mda, session.h5), which files it
+holds.  File names are stored relative to the folder.
+"""
+import os
+import sys
+import json
+import hashlib
+
+import convert_rhd
+from intanutil.recording_set import RecordingSet
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'conversion_manifest.json'
+
+# Bytes hashed from each end of a file for its fingerprint.
+FINGERPRINT_BYTES = 1 << 20
+
+
+def fingerprint(filename, num_bytes=FINGERPRINT_BYTES):
+    """Returns a sha1 hex digest of the size and the first and last num_bytes of filename.
+
+    The start of an rhd file holds its header and first data blocks, the end the last
+    blocks written, so a fingerprint changes when a file is replaced or grows while
+    costing the same for every file, however long the recording.
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fid:
+        size = os.fstat(fid.fileno()).st_size
+        h.update(str(size).encode('ascii'))
+        h.update(fid.read(num_bytes))
+        if size > num_bytes:
+            fid.seek(max(num_bytes, size - num_bytes))
+            h.update(fid.read(num_bytes))
+    return h.hexdigest()
+
+
+def get_manifest_filename(folder):
+    """Returns where the manifest of folder is stored."""
+    return os.path.join(folder, MANIFEST_NAME)
+
+
+def load_manifest(folder):
+    """Returns the manifest of folder, or an empty one if there is none or it cannot be read."""
+    try:
+        with open(get_manifest_filename(folder), 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('manifest_version') == MANIFEST_VERSION:
+            return manifest
+    except (IOError, OSError, ValueError):
+        pass
+    return {'manifest_version': MANIFEST_VERSION, 'files': {}, 'outputs': {}}
+
+
+def save_manifest(folder, manifest):
+    """Writes the manifest of folder, replacing the old one only once the new one is complete."""
+    manifest_filename = get_manifest_filename(folder)
+    tmp_filename = manifest_filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_filename, manifest_filename)
+
+
+def file_unchanged(folder, name, entry):
+    """Returns whether the file name of folder still matches its manifest entry.
+
+    Only a file whose size or modification time differs from the entry is read, to
+    compare its fingerprint; a file that matches again (e.g. was copied back) has its
+    entry brought up to date.
+    """
+    if entry is None:
+        return False
+    path = os.path.join(folder, name)
+    st = os.stat(path)
+    if st.st_size != entry['size']:
+        return False
+    if st.st_mtime_ns != entry['mtime_ns']:
+        if fingerprint(path) != entry['fingerprint']:
+            return False
+        entry['mtime_ns'] = st.st_mtime_ns
+    return True
+
+
+def get_outputs(meta):
+    """Returns the per-file outputs listed in the metadata from convert_rhd_file."""
+    return ([meta['dat_file']] if meta['dat_file'] else []) + meta['di_files'] + meta['ai_files']
+
+
+def pending_files(folder, files=None, manifest=None, dat=True):
+    """Returns the rhd files of folder that are new, changed or missing outputs since the last conversion.
+
+    files is the list of rhd file names relative to folder; None takes every .rhd file in it.
+    dat asks for the per-file .dat outputs as well.
+    """
+    if files is None:
+        files = [f for f in os.listdir(folder) if f.endswith('.rhd')]
+    if manifest is None:
+        manifest = load_manifest(folder)
+    pending = []
+    for name in files:
+        entry = manifest['files'].get(name)
+        if (not file_unchanged(folder, name, entry) or (dat and not entry['meta']['dat_file'])
+                or not all(os.path.exists(os.path.join(folder, f)) for f in get_outputs(entry['meta']))):
+            pending.append(name)
+    return pending
+
+
+def update_folder(folder, files, num_workers=None, dat=True, concatenated=()):
+    """Converts the rhd files of folder that are new or changed since the last run and updates the manifest.
+
+    files is the ordered list of rhd file names relative to folder.
+    num_workers and dat are passed on to convert_rhd.convert_rhd_files.
+    concatenated lists outputs holding all files one after another, relative to folder;
+    names ending in .mda are written with convert_rhd.write_mda, in .h5 with
+    intanutil.session_file.write_session (the auxiliary streams), others with write_dat.
+    Files added after the ones an output already holds are appended to it; if any file
+    it holds changed or disappeared, or the files were reordered, it is written again.
+
+    Returns the metadata from convert_rhd_file for every file in files, in order.
+    """
+    manifest = load_manifest(folder)
+    pending = pending_files(folder, files, manifest, dat)
+
+    if pending:
+        metadata = convert_rhd.convert_rhd_files([os.path.join(folder, f) for f in pending], num_workers, dat)
+        for name, meta in zip(pending, metadata):
+            path = os.path.join(folder, name)
+            st = os.stat(path)
+            meta = relative_meta(folder, meta)
+            meta['rhd_file'] = name
+            manifest['files'][name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'fingerprint': fingerprint(path), 'meta': meta}
+    for name in list(manifest['files']):
+        if name not in files:
+            del manifest['files'][name]
+    save_manifest(folder, manifest)
+
+    # Where the converted amplifier samples of each file already are, so each concatenated
+    # output copies them instead of decoding and notch filtering the file again.
+    sources = {}
+    for name in files:
+        meta = manifest['files'][name]['meta']
+        if meta['dat_file'] and os.path.getsize(os.path.join(folder, meta['dat_file'])) == meta['num_samples'] * meta['num_channels'] * 2:
+            sources[name] = (os.path.join(folder, meta['dat_file']), 0)
+    for output in concatenated:
+        update_concatenated(folder, output, files, manifest, sources)
+        save_manifest(folder, manifest)
+
+    return [manifest['files'][name]['meta'] for name in files]
+
+
+def relative_meta(folder, meta):
+    """Returns the metadata from convert_rhd_file with its file names relative to folder."""
+    meta = dict(meta)
+    if meta['dat_file']:
+        meta['dat_file'] = os.path.relpath(meta['dat_file'], folder)
+    meta['di_files'] = [os.path.relpath(f, folder) for f in meta['di_files']]
+    meta['ai_files'] = [os.path.relpath(f, folder) for f in meta['ai_files']]
+    return meta
+
+
+def update_concatenated(folder, output, files, manifest, sources=None):
+    """Brings the concatenated output of folder up to date with files, appending when it can.
+
+    sources maps file names to the (path, byte offset) of their converted amplifier samples,
+    which .dat and .mda outputs copy (see convert_rhd.write_amplifier); the samples of
+    files in such an output are added to it.
+    """
+    if sources is None:
+        sources = {}
+    path = os.path.join(folder, output)
+    entry = manifest['outputs'].get(output)
+    fingerprints = [manifest['files'][name]['fingerprint'] for name in files]
+
+    append = (entry is not None and os.path.exists(path) and os.path.getsize(path) == entry['size']
+              and entry['files'] == files[:len(entry['files'])] and entry['fingerprints'] == fingerprints[:len(entry['files'])])
+    new_files = files[len(entry['files']):] if append else files
+    if append and not new_files:
+        add_sources(folder, output, files, manifest, sources)
+        return
+    if append and output.endswith('.mda'):
+        # .mda dimensions switch from 32 to 64 bit at 2**31 samples, which changes the size
+        # of the header in front of the data; then the whole file is written again
+        with open(path, 'rb') as fid:
+            dtype, shape, header_size = convert_rhd.read_mda_header(fid)
+        total = shape[-1] + sum(manifest['files'][name]['meta']['num_samples'] for name in new_files)
+        if (max(shape) < 2**31) != (total < 2**31):
+            append = False
+            new_files = files
+
+    if append and output.endswith('.h5'):
+        # sessions from an older write_session are written again
+        from intanutil.session_file import get_session_version, SESSION_VERSION
+        if get_session_version(path) != SESSION_VERSION:
+            append = False
+            new_files = files
+
+    if output.endswith('.h5'):
+        from intanutil.session_file import write_session as write
+    elif output.endswith('.mda'):
+        write = convert_rhd.write_mda
+    else:
+        write = convert_rhd.write_dat
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if new_files:
+        with RecordingSet([os.path.join(folder, name) for name in new_files]) as recordings:
+            if output.endswith('.h5'):
+                write(recordings, path, append=append)
+            else:
+                write(recordings, path, append=append, sources=[sources.get(name) for name in new_files])
+        print('{} {} file(s) to {}'.format('Appended' if append else 'Wrote', len(new_files), path))
+    else:
+        open(path, 'wb').close()
+    manifest['outputs'][output] = {'files': list(files), 'fingerprints': fingerprints, 'size': os.path.getsize(path)}
+    add_sources(folder, output, files, manifest, sources)
+
+
+def add_sources(folder, output, files, manifest, sources):
+    """Adds the files held by the up-to-date .dat or .mda output of folder to sources, unless they are in it already."""
+    path = os.path.join(folder, output)
+    if output.endswith('.h5') or not files or os.path.getsize(path) == 0:
+        return
+    offset = 0
+    if output.endswith('.mda'):
+        with open(path, 'rb') as fid:
+            offset = convert_rhd.read_mda_header(fid)[2]
+    for name in files:
+        meta = manifest['files'][name]['meta']
+        sources.setdefault(name, (path, offset))
+        offset += meta['num_samples'] * meta['num_channels'] * 2
+
+
+def main():
+    folder = sys.argv[1]
+    files = sorted((f for f in os.listdir(folder) if f.endswith('.rhd')), key=lambda f: os.path.getmtime(os.path.join(folder, f)))
+    update_folder(folder, files, concatenated=['alldata/raw.dat'])
+
+if __name__ == '__main__':
+    main()
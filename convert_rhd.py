@@ -0,0 +1,264 @@
+"""Converts rhd files to the .dat, .mda, .di and .ai files used by the clustering pipelines."""
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+
+import read_rhd as rhd
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.read_data_blocks import get_data_block_dtype
+from intanutil.rhd_recording import RhdRecording
+
+
+# Data blocks decoded per chunk; about 1 MB of amplifier data per chunk for 32 channels.
+BLOCKS_PER_CHUNK = 256
+
+
+def convert_rhd_file(file, blocks_per_chunk=BLOCKS_PER_CHUNK, dat=True, notch_workers=1):
+    """Converts one rhd file, writing its outputs next to it.
+
+    Writes the amplifier data as a sample-major uint16 .dat file (unless dat is False, for
+    pipelines that only use the concatenated recording), one .di file per digital input
+    channel and one .ai file per aux input channel.  The file is streamed
+    blocks_per_chunk data blocks at a time through reusable buffers, so memory use does
+    not grow with the length of the recording.  If the recording asked for a software
+    notch filter, it is applied to the .dat data as read_rhd does, with notch_workers
+    threads.
+
+    Returns a dictionary with the metadata needed to write the .prm file, so the rhd
+    file never has to be read again, and the dtypes of the .di and .ai files.
+    """
+    base = os.path.splitext(file)[0]
+    with open(file, 'rb') as fid:
+        header = read_header(fid, quiet=True)
+        data_offset = fid.tell()
+        bytes_per_block = int(get_bytes_per_data_block(header))
+        bytes_remaining = os.fstat(fid.fileno()).st_size - data_offset
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = bytes_remaining // bytes_per_block
+
+        n = header['num_samples_per_data_block']
+        num_channels = header['num_amplifier_channels']
+        meta = {'rhd_file': file,
+                'dat_file': base + '.dat' if dat else None,
+                'di_files': [base + 'chan' + str(i) + '.di' for i in range(header['num_board_dig_in_channels'])],
+                'ai_files': [base + 'chan' + str(i) + '.ai' for i in range(header['num_aux_input_channels'])],
+                'di_dtype': np.dtype(np.uint).str, # C unsigned long: 4 bytes on Windows, 8 on Linux
+                'ai_dtype': np.dtype(np.float64).str,
+                'sample_rate': header['frequency_parameters']['amplifier_sample_rate'],
+                'num_channels': num_channels,
+                'num_samples': n * num_data_blocks}
+        notch = header['notch_filter_frequency'] > 0 and num_channels > 0 and num_data_blocks > 0 and dat
+
+        blocks = np.zeros(blocks_per_chunk, dtype=get_data_block_dtype(header))
+        block_bytes = blocks.view(np.uint8)
+        samples = np.zeros([blocks_per_chunk, n, num_channels], dtype=np.uint16)
+        with ExitStack() as stack:
+            dat_fid = stack.enter_context(open(meta['dat_file'], 'wb')) if dat else None
+            di_fids = [stack.enter_context(open(f, 'wb')) for f in meta['di_files']]
+            ai_fids = [stack.enter_context(open(f, 'wb')) for f in meta['ai_files']]
+
+            for first_block in range(0, num_data_blocks, blocks_per_chunk):
+                count = min(blocks_per_chunk, num_data_blocks - first_block)
+                if fid.readinto(block_bytes[:count * bytes_per_block]) != count * bytes_per_block:
+                    raise Exception('Error: End of file reached before all data blocks were read.')
+                chunk = blocks[:count]
+
+                #save amplifier data as .dat, transposing one data block at a time
+                if dat and num_channels > 0 and not notch:
+                    np.copyto(samples[:count], chunk['amplifier'].transpose(0, 2, 1))
+                    samples[:count].tofile(dat_fid)
+                #save digital input streams
+                if di_fids:
+                    words = chunk['board_dig_in'].reshape(-1)
+                    for channel, di_fid in zip(header['board_dig_in_channels'], di_fids):
+                        np.not_equal(np.bitwise_and(words, 1 << channel['native_order']), 0).astype(np.uint).tofile(di_fid)
+                #save aux inputs (units = volts)
+                for i, ai_fid in enumerate(ai_fids):
+                    np.multiply(37.4e-6, chunk['aux_input'][:, i, :].reshape(-1)).tofile(ai_fid)
+
+    if notch:
+        # The zero-phase notch needs samples on both sides of each chunk, so it reads the
+        # memory-mapped recording and writes straight into the memory-mapped .dat file.
+        dat = np.memmap(meta['dat_file'], dtype=np.uint16, mode='w+', shape=(meta['num_samples'], num_channels))
+        with RhdRecording(file) as rec:
+            rhd.notch_filter_channels(rec.amplifier, header['sample_rate'], header['notch_filter_frequency'], out=dat.T,
+                                      chunk_size=blocks_per_chunk * n * 16, num_workers=notch_workers)
+        dat.flush()
+        del dat
+    return meta
+
+
+def write_dat(recordings, dat_file, blocks_per_chunk=BLOCKS_PER_CHUNK, append=False, sources=None):
+    """Writes the amplifier data of a RecordingSet as one sample-major uint16 .dat file.
+
+    The files of the set are written one after another, blocks_per_chunk data blocks at
+    a time, straight into the memory-mapped output; each file is notch filtered on its
+    own if its header asks for it.  The result is byte for byte the concatenation of the
+    .dat files convert_rhd_file writes for the same files.  With append the samples are
+    added to the end of an existing dat_file.  sources is passed on to write_amplifier.
+
+    Returns the number of samples written.
+    """
+    offset = os.path.getsize(dat_file) if append else 0
+    return write_amplifier(recordings, dat_file, offset, blocks_per_chunk, sources)
+
+
+def write_mda(recordings, mda_file, blocks_per_chunk=BLOCKS_PER_CHUNK, append=False, sources=None):
+    """Writes the amplifier data of a RecordingSet as a num_channels x num_samples uint16 .mda file.
+
+    The header is written first, sized from the sample counts of the RHD headers and file
+    sizes, and the column-major samples (the same bytes as write_dat) are then streamed
+    after it, so the recording is never held in memory.  With append the samples are
+    added to the end of an existing uint16 mda_file and its header updated.  sources is
+    passed on to write_amplifier.
+
+    Returns the number of samples written.
+    """
+    num_channels = recordings.header['num_amplifier_channels']
+    previous = 0
+    if append:
+        with open(mda_file, 'rb') as fid:
+            dtype, shape, header_size = read_mda_header(fid)
+        if dtype != np.uint16 or len(shape) != 2 or shape[0] != num_channels:
+            raise Exception('Cannot append {} channel uint16 samples to {} ({} {})'.format(num_channels, mda_file, dtype, shape))
+        previous = shape[1]
+        if (max(shape) < 2**31) != (previous + recordings.num_samples < 2**31):
+            raise Exception('Appending to {} changes the size of its header; write it again instead'.format(mda_file))
+    with open(mda_file, 'r+b' if append else 'wb') as fid:
+        offset = write_mda_header(fid, np.uint16, (num_channels, previous + recordings.num_samples))
+    return write_amplifier(recordings, mda_file, offset + previous * num_channels * 2, blocks_per_chunk, sources)
+
+
+def write_amplifier(recordings, filename, offset, blocks_per_chunk=BLOCKS_PER_CHUNK, sources=None):
+    """Writes the amplifier samples of a RecordingSet, sample-major, at byte offset of filename.
+
+    sources holds, for each file of the set, None or the (filename, byte offset) of its
+    samples already written the same way (e.g. its .dat file), which are copied instead of
+    being decoded and notch filtered again.
+    """
+    num_channels = recordings.header['num_amplifier_channels']
+    if recordings.num_samples == 0 or num_channels == 0:
+        with open(filename, 'r+b' if offset else 'wb') as fid:
+            fid.truncate(offset)
+        return recordings.num_samples
+
+    dat = np.memmap(filename, dtype=np.uint16, mode='r+' if offset else 'w+', offset=offset,
+                    shape=(recordings.num_samples, num_channels))
+    if sources is None:
+        sources = [None] * len(recordings.recordings)
+    for rec, start, stop, source in zip(recordings.recordings, recordings.file_starts[:-1], recordings.file_starts[1:], sources):
+        out = dat[start:stop].T
+        chunk_size = blocks_per_chunk * rec.samples_per_block
+        if source is not None and rec.num_samples > 0:
+            converted = np.memmap(source[0], dtype=np.uint16, mode='r', offset=source[1], shape=(rec.num_samples, num_channels))
+            for first in range(0, rec.num_samples, chunk_size):
+                dat[start + first:min(start + first + chunk_size, stop)] = converted[first:first + chunk_size]
+            del converted
+        elif rec.header['notch_filter_frequency'] > 0 and rec.num_samples > 0:
+            rhd.notch_filter_channels(rec.amplifier, rec.sample_rate, rec.header['notch_filter_frequency'], out=out,
+                                      chunk_size=chunk_size * 16, num_workers=1)
+        else:
+            for first in range(0, rec.num_samples, chunk_size):
+                out[:, first:first + chunk_size] = rec.amplifier[:, first:first + chunk_size]
+    dat.flush()
+    del dat
+    return recordings.num_samples
+
+
+# Data type codes of the MountainSort .mda format.
+MDA_DTYPE_CODES = {np.dtype(np.uint8): -2, np.dtype(np.float32): -3, np.dtype(np.int16): -4, np.dtype(np.int32): -5,
+                   np.dtype(np.uint16): -6, np.dtype(np.float64): -7, np.dtype(np.uint32): -8}
+
+
+def write_mda_header(fid, dtype, shape):
+    """Writes the header of an .mda file holding a column-major array of dtype and shape.
+
+    Returns the size of the header in bytes, where the data starts.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in MDA_DTYPE_CODES:
+        raise ValueError('dtype {} cannot be stored in an .mda file'.format(dtype))
+    if max(shape) < 2**31:
+        header = np.array([MDA_DTYPE_CODES[dtype], dtype.itemsize, len(shape)], dtype='<i4').tobytes() + np.array(shape, dtype='<i4').tobytes()
+    else:
+        # a negative number of dimensions marks 64 bit dimensions
+        header = np.array([MDA_DTYPE_CODES[dtype], dtype.itemsize, -len(shape)], dtype='<i4').tobytes() + np.array(shape, dtype='<i8').tobytes()
+    fid.write(header)
+    return len(header)
+
+
+def read_mda_header(fid):
+    """Reads the header of an .mda file.
+
+    Returns (dtype, shape, header size in bytes).
+    """
+    codes = {code: dtype for dtype, code in MDA_DTYPE_CODES.items()}
+    dtype_code, bytes_per_entry, num_dims = np.frombuffer(fid.read(12), dtype='<i4')
+    if dtype_code not in codes:
+        raise Exception('Unknown .mda data type code {}'.format(dtype_code))
+    if num_dims < 0:
+        shape = np.frombuffer(fid.read(-8 * num_dims), dtype='<i8')
+    else:
+        shape = np.frombuffer(fid.read(4 * num_dims), dtype='<i4')
+    return codes[dtype_code], tuple(int(x) for x in shape), 12 + shape.nbytes
+
+
+def dat_to_mda(dat_file, mda_file, num_channels, dtype=np.uint16, chunk_size=1 << 24):
+    """Converts a sample-major .dat file to a num_channels x num_samples .mda file.
+
+    The two formats store the samples in the same order, so the .dat bytes are streamed
+    chunk_size bytes at a time after the .mda header.  Returns the number of samples.
+    """
+    dtype = np.dtype(dtype)
+    size = os.path.getsize(dat_file)
+    if size % (num_channels * dtype.itemsize) != 0:
+        raise Exception('{} does not hold a whole number of {} channel samples'.format(dat_file, num_channels))
+    num_samples = size // (num_channels * dtype.itemsize)
+    with open(dat_file, 'rb') as src, open(mda_file, 'wb') as dst:
+        write_mda_header(dst, dtype, (num_channels, num_samples))
+        shutil.copyfileobj(src, dst, chunk_size)
+    return num_samples
+
+
+def convert_rhd_files(files, num_workers=None, dat=True):
+    """Converts a list of rhd files in parallel, one file per worker process.
+
+    files is an ordered list of rhd file names.
+    num_workers is the number of worker processes; None uses one per CPU and 1 converts
+    the files one after another in this process.
+    dat is passed on to convert_rhd_file.  The CPUs are shared among the worker processes
+    for notch filtering, so they do not each start a thread per CPU.
+
+    Returns the metadata dictionaries from convert_rhd_file in the same order as files.
+    """
+    tic = time.time()
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(files)))
+
+    notch_workers = max(1, (os.cpu_count() or 1) // num_workers)
+
+    if num_workers == 1:
+        metadata = [convert_rhd_file(file, dat=dat, notch_workers=notch_workers) for file in files]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            metadata = list(pool.map(convert_rhd_file, files, [BLOCKS_PER_CHUNK] * len(files), [dat] * len(files),
+                                     [notch_workers] * len(files)))
+    print('Converted {0} files with {1} worker(s) in {2:0.1f} seconds'.format(len(files), num_workers, time.time() - tic))
+    return metadata
+
+
+def main():
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    files = sorted((os.path.join(sys.argv[1], f) for f in os.listdir(sys.argv[1]) if f.endswith('.rhd')), key=os.path.getmtime)
+    convert_rhd_files(files, num_workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#! /bin/env python
+#
+# Output dtype policies for decoded RHD2000 data.
+
+import numpy as np
+
+# 'raw' keeps the uint16 samples stored in the file, 'int16' centers the signed streams
+# around zero without scaling and 'float32' scales every stream to physical units.
+DTYPE_POLICIES = ('raw', 'int16', 'float32')
+
+
+class DigitalLines(object):
+    """Per-line boolean view of a raw digital word stream, indexed as lines[line, samples].
+
+    raw is the uint16 word stream (an array or an RhdRecording stream view); a line is
+    masked out of it only when it is indexed, using each channel's native_order bit.
+    np.asarray(lines) gives the dense [num_channels, num_samples] boolean array.
+    """
+
+    def __init__(self, raw, channels):
+        self.raw = raw
+        self.channels = channels
+        self.bits = np.array([c['native_order'] for c in channels], dtype=np.uint16)
+
+    @property
+    def shape(self):
+        return (len(self.channels), len(self.raw))
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __array__(self, dtype=None):
+        a = self[...]
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        lines, t_key = key
+        if lines is Ellipsis:
+            lines = slice(None)
+        words = self.raw[t_key]
+        bits = self.bits[lines]
+        if np.ndim(bits) > 0:
+            bits = bits.reshape((-1,) + (1,) * np.ndim(words))
+        return np.not_equal(np.bitwise_and(np.right_shift(words, bits), 1), 0)
+
+    def packbits(self):
+        """Returns the lines bit-packed with np.packbits, one uint8 row of ceil(num_samples / 8) bytes per line.
+
+        Lines are unpacked with np.unpackbits(packed, axis=1, count=num_samples).
+        """
+
+        words = self.raw[:]
+        packed = np.zeros([len(self.channels), (len(words) + 7) // 8], dtype=np.uint8)
+        for i, bit in enumerate(self.bits):
+            packed[i] = np.packbits(np.not_equal(np.bitwise_and(words, 1 << int(bit)), 0))
+        return packed
+
+
+def center_uint16(x):
+    """Returns x - 32768 as int16, flipping the sign bit in place when x is writable."""
+
+    if not x.flags.writeable:
+        x = x.copy()
+    np.bitwise_xor(x, np.uint16(0x8000), out=x)
+    return x.view(np.int16)
+
+
+def scale_uint16(x, scale, center=False):
+    """Returns (x - 32768 if center else x) * scale as float32."""
+
+    out = x.astype(np.float32)
+    if center:
+        out -= 32768
+    out *= scale
+    return out
+
+
+def convert_data(data, header, dtype):
+    """Converts the streams decoded by read_data_blocks to the given dtype policy.
+
+    The sample streams are converted with convert_streams.  In every policy the digital
+    inputs and outputs stay as the raw uint16 words, with a DigitalLines accessor over
+    them in 'board_dig_in_data' and 'board_dig_out_data'.
+    data is modified in place and returned.
+    """
+
+    convert_streams(data, header, dtype)
+    return add_digital_lines(data, header)
+
+
+def add_digital_lines(data, header):
+    """Adds DigitalLines accessors over the raw digital words of data as 'board_dig_in_data' and 'board_dig_out_data'."""
+
+    data['board_dig_in_data'] = DigitalLines(data['board_dig_in_raw'], header['board_dig_in_channels'])
+    data['board_dig_out_data'] = DigitalLines(data['board_dig_out_raw'], header['board_dig_out_channels'])
+    return data
+
+
+def convert_streams(data, header, dtype):
+    """Converts the sample streams of data, as decoded by read_data_blocks, to the given dtype policy.
+
+    'raw': amplifier, aux input, supply voltage, temperature and ADC data stay uint16.
+    'int16': amplifier data (and board ADC data for signed eval board modes 1 and 13)
+        become int16 centered on zero; the unsigned streams stay uint16.
+    'float32': all streams are scaled to float32 microvolts (amplifier), volts (aux,
+        supply, ADC) and degrees C (temperature).
+    Each sample is converted on its own, so data may be one chunk of a file.
+    data is modified in place and returned.
+    """
+
+    if dtype not in DTYPE_POLICIES:
+        raise ValueError('dtype must be one of {}, not {!r}'.format(DTYPE_POLICIES, dtype))
+
+    signed_adc = header['eval_board_mode'] in (1, 13)
+    if dtype == 'int16':
+        data['amplifier_data'] = center_uint16(data['amplifier_data'])
+        if signed_adc:
+            data['board_adc_data'] = center_uint16(data['board_adc_data'])
+
+    elif dtype == 'float32':
+        data['amplifier_data'] = scale_uint16(data['amplifier_data'], 0.195, center=True)       # units = microvolts
+        data['aux_input_data'] = scale_uint16(data['aux_input_data'], 37.4e-6)                  # units = volts
+        data['supply_voltage_data'] = scale_uint16(data['supply_voltage_data'], 74.8e-6)        # units = volts
+        if header['eval_board_mode'] == 1:
+            data['board_adc_data'] = scale_uint16(data['board_adc_data'], 152.59e-6, center=True)  # units = volts
+        elif header['eval_board_mode'] == 13:
+            data['board_adc_data'] = scale_uint16(data['board_adc_data'], 312.5e-6, center=True)   # units = volts
+        else:
+            data['board_adc_data'] = scale_uint16(data['board_adc_data'], 50.354e-6)           # units = volts
+        data['temp_sensor_data'] = scale_uint16(data['temp_sensor_data'], 0.01)                 # units = deg C
+
+    return data
@@ -19,6 +19,8 @@ def data_to_result(header, data, data_present):
         result['t_dig'] = data['t_dig']
     if header['num_temp_sensor_channels'] > 0 and data_present:
         result['t_temp_sensor'] = data['t_temp_sensor']
+    if data_present:
+        result['timestamp_gaps'] = data['timestamp_gaps']
         
     if header['num_amplifier_channels'] > 0:
         result['spike_triggers'] = header['spike_triggers']
@@ -0,0 +1,159 @@
+#! /bin/env python
+#
+# Rising and falling edges of the digital lines of RHD2000 files, with a sidecar cache.
+
+import os, sys
+import numpy as np
+
+from intanutil.rhd_recording import RhdRecording
+
+EVENTS_VERSION = 1
+EVENTS_SUFFIX = '.events.npz'
+DIGITAL_STREAMS = ('board_dig_in', 'board_dig_out')
+
+
+class EdgeFinder(object):
+    """Finds the edges of every line of a raw digital word stream fed to it chunk by chunk.
+
+    Each chunk costs one XOR against the previous word; only the samples where some line
+    changed are then tested per line.  An onset is the index of the first sample at which
+    a line is high, an offset the first sample at which it is low again; a line that is
+    already high at sample 0 has no onset there.
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.masks = [1 << c['native_order'] for c in channels]
+        self.num_samples = 0
+        self.previous = None
+        self.initial_state = None
+        self._onsets = [[] for c in channels]
+        self._offsets = [[] for c in channels]
+
+    def update(self, words):
+        """Adds the next chunk of raw uint16 words."""
+
+        words = np.asarray(words, dtype=np.uint16)
+        if len(words) == 0:
+            return
+        if self.previous is None:
+            self.previous = words[0]
+            self.initial_state = np.array([(int(words[0]) & m) != 0 for m in self.masks], dtype=np.bool_)
+
+        changed = np.empty_like(words)
+        changed[0] = words[0] ^ self.previous
+        np.bitwise_xor(words[1:], words[:-1], out=changed[1:])
+
+        index = np.flatnonzero(changed)
+        if len(index) > 0:
+            changed = changed[index]
+            level = words[index]
+            index += self.num_samples
+            for i, m in enumerate(self.masks):
+                edge = np.bitwise_and(changed, m) != 0
+                high = np.bitwise_and(level, m) != 0
+                self._onsets[i].append(index[edge & high])
+                self._offsets[i].append(index[edge & ~high])
+
+        self.previous = words[-1]
+        self.num_samples += len(words)
+
+    def edges(self):
+        """Returns (onsets, offsets), one int64 array of sample indices per line."""
+
+        onsets = [np.concatenate(x).astype(np.int64) if x else np.zeros(0, dtype=np.int64) for x in self._onsets]
+        offsets = [np.concatenate(x).astype(np.int64) if x else np.zeros(0, dtype=np.int64) for x in self._offsets]
+        return onsets, offsets
+
+
+def find_digital_events(filename, samples_per_chunk=1 << 20):
+    """Finds the onsets and offsets of every digital input and output line of an RHD2000 file.
+
+    The raw digital words are read from the memory-mapped file samples_per_chunk at a time,
+    so memory use does not grow with the length of the recording.  Returns a dictionary
+    with 'num_samples' and, for 'board_dig_in' and 'board_dig_out', a dictionary of
+    'onsets' and 'offsets' (one array of sample indices per line, in the same order as the
+    rows of board_dig_in_data / board_dig_out_data) and 'initial_state' (the level of each
+    line at sample 0).
+    """
+
+    with RhdRecording(filename) as rec:
+        events = {'num_samples': rec.num_samples}
+        for stream in DIGITAL_STREAMS:
+            channels = rec.header[stream + '_channels']
+            finder = EdgeFinder(channels)
+            if channels:
+                raw = getattr(rec, stream + '_raw')
+                for start in range(0, rec.num_samples, samples_per_chunk):
+                    finder.update(raw[start:start + samples_per_chunk])
+            onsets, offsets = finder.edges()
+            initial_state = finder.initial_state if finder.initial_state is not None else np.zeros(len(channels), dtype=np.bool_)
+            events[stream] = {'onsets': onsets, 'offsets': offsets, 'initial_state': initial_state}
+    return events
+
+
+def get_events_filename(filename):
+    """Returns where the event index for filename is stored."""
+
+    return filename + EVENTS_SUFFIX
+
+
+def get_digital_events(filename):
+    """Returns find_digital_events(filename), from the sidecar next to the file when it is still valid.
+
+    The sidecar is keyed by the size and modification time of the recording; when either
+    differs the edges are found again and the sidecar rewritten.  Failing to write the
+    sidecar (e.g. on a read-only share) is not an error.
+    """
+
+    events_filename = get_events_filename(filename)
+    st = os.stat(filename)
+
+    try:
+        with np.load(events_filename) as f:
+            if (int(f['events_version']) == EVENTS_VERSION and int(f['size']) == st.st_size
+                    and int(f['mtime_ns']) == st.st_mtime_ns):
+                return unpack_events(f)
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    events = find_digital_events(filename)
+    try:
+        tmp_filename = events_filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, events_version=EVENTS_VERSION, size=st.st_size, mtime_ns=st.st_mtime_ns, **pack_events(events))
+        os.replace(tmp_filename, events_filename)
+    except (IOError, OSError):
+        print('Could not write event index {}'.format(events_filename))
+    return events
+
+
+def pack_events(events):
+    """Flattens the dictionary from find_digital_events into named arrays for np.savez."""
+
+    arrays = {'num_samples': events['num_samples']}
+    for stream in DIGITAL_STREAMS:
+        arrays[stream + '_initial_state'] = events[stream]['initial_state']
+        for i, (onsets, offsets) in enumerate(zip(events[stream]['onsets'], events[stream]['offsets'])):
+            arrays['{}_onsets_{}'.format(stream, i)] = onsets
+            arrays['{}_offsets_{}'.format(stream, i)] = offsets
+    return arrays
+
+
+def unpack_events(arrays):
+    """Inverse of pack_events."""
+
+    events = {'num_samples': int(arrays['num_samples'])}
+    for stream in DIGITAL_STREAMS:
+        initial_state = arrays[stream + '_initial_state']
+        events[stream] = {'onsets': [arrays['{}_onsets_{}'.format(stream, i)] for i in range(len(initial_state))],
+                          'offsets': [arrays['{}_offsets_{}'.format(stream, i)] for i in range(len(initial_state))],
+                          'initial_state': initial_state}
+    return events
+
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:]:
+        events = get_digital_events(filename)
+        for i, onsets in enumerate(events['board_dig_in']['onsets']):
+            print(filename, 'digital input', i, len(onsets), 'onsets')
@@ -0,0 +1,104 @@
+#! /bin/env python
+#
+# Sidecar cache of the parsed header and block index of RHD2000 files.
+
+import os, sys, json, hashlib, struct
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.info.json'
+
+
+def get_cache_filename(filename, cache_dir=None):
+    """Returns where the sidecar for filename is stored.
+
+    By default the sidecar sits next to the data file; if cache_dir is given it is
+    stored there instead, named by a hash of the absolute path of the data file.
+    """
+
+    if cache_dir is None:
+        return filename + CACHE_SUFFIX
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+
+def read_recording_info(filename):
+    """Parses the header of filename and indexes its data blocks.
+
+    Returns a dictionary with the header, the data-region offset, bytes per block,
+    number of whole data blocks and the first and last timestamps (None if the file
+    holds no data).
+    """
+
+    st = os.stat(filename)
+    with open(filename, 'rb') as fid:
+        header = read_header(fid, quiet=True)
+        data_offset = fid.tell()
+
+        bytes_per_block = int(get_bytes_per_data_block(header))
+        num_data_blocks = (st.st_size - data_offset) // bytes_per_block
+
+        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+            timestamp_format = '<i'
+        else:
+            timestamp_format = '<I'
+
+        first_timestamp = None
+        last_timestamp = None
+        if num_data_blocks > 0:
+            fid.seek(data_offset)
+            first_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+            fid.seek(data_offset + (num_data_blocks - 1) * bytes_per_block + (header['num_samples_per_data_block'] - 1) * 4)
+            last_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+
+    return {'cache_version': CACHE_VERSION,
+            'path': os.path.abspath(filename),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'header': header,
+            'data_offset': data_offset,
+            'bytes_per_block': bytes_per_block,
+            'num_data_blocks': num_data_blocks,
+            'first_timestamp': first_timestamp,
+            'last_timestamp': last_timestamp}
+
+
+def get_recording_info(filename, cache_dir=None):
+    """Returns read_recording_info(filename), from the sidecar cache when it is still valid.
+
+    The sidecar is keyed by absolute path, size and modification time; when any of
+    them differ the file is parsed again and the sidecar rewritten.  Failing to write
+    the sidecar (e.g. on a read-only share) is not an error.
+    """
+
+    cache_filename = get_cache_filename(filename, cache_dir)
+    st = os.stat(filename)
+
+    try:
+        with open(cache_filename, 'r') as f:
+            info = json.load(f)
+        if (info.get('cache_version') == CACHE_VERSION and info['path'] == os.path.abspath(filename)
+                and info['size'] == st.st_size and info['mtime_ns'] == st.st_mtime_ns):
+            return info
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    info = read_recording_info(filename)
+    try:
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_filename = cache_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_filename, cache_filename)
+    except (IOError, OSError):
+        print('Could not write header cache {}'.format(cache_filename))
+    return info
+
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:]:
+        info = get_recording_info(filename)
+        print(filename, info['num_data_blocks'], info['first_timestamp'], info['last_timestamp'])
@@ -0,0 +1,121 @@
+#! /bin/env python
+#
+# Decode engine shared by read_rhd.read_rhd and read_rhd_controller.read_data.
+
+import os
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.read_data_blocks import read_data_blocks, select_channels
+from intanutil.convert_data import add_digital_lines, DTYPE_POLICIES
+from intanutil.time_axis import TimeAxis
+
+
+def load_data(filename, channels=None, streams=None, dig_lines=None, dtype=None, quiet=False):
+    """Reads an Intan Technologies RHD2000 data file with 60 or 128 sample data blocks.
+
+    channels, streams and dig_lines select what is decoded (see
+    intanutil.read_data_blocks.select_channels).  dtype is an output policy from
+    intanutil.convert_data.DTYPE_POLICIES; None leaves every stream as the uint16 samples
+    stored in the file and the digital inputs and outputs as raw words only, for the
+    caller to convert.  Times (in seconds) are added for every stream, as float64 arrays
+    when dtype is None and as intanutil.time_axis.TimeAxis objects otherwise, and
+    'timestamp_gaps' holds the (sample, expected, actual) rows from find_timestamp_gaps.
+
+    Returns (header, data, data_present), where header describes the selected channels.
+    """
+
+    if dtype is not None and dtype not in DTYPE_POLICIES:
+        raise ValueError('dtype must be None or one of {}'.format(DTYPE_POLICIES))
+
+    log = (lambda *args: None) if quiet else print
+
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        header = read_header(fid, quiet=quiet)
+
+        log('Found {} amplifier channel{}.'.format(header['num_amplifier_channels'], plural(header['num_amplifier_channels'])))
+        log('Found {} auxiliary input channel{}.'.format(header['num_aux_input_channels'], plural(header['num_aux_input_channels'])))
+        log('Found {} supply voltage channel{}.'.format(header['num_supply_voltage_channels'], plural(header['num_supply_voltage_channels'])))
+        log('Found {} board ADC channel{}.'.format(header['num_board_adc_channels'], plural(header['num_board_adc_channels'])))
+        log('Found {} board digital input channel{}.'.format(header['num_board_dig_in_channels'], plural(header['num_board_dig_in_channels'])))
+        log('Found {} board digital output channel{}.'.format(header['num_board_dig_out_channels'], plural(header['num_board_dig_out_channels'])))
+        log('Found {} temperature sensors channel{}.'.format(header['num_temp_sensor_channels'], plural(header['num_temp_sensor_channels'])))
+        log('')
+
+        # Determine how many samples the data file contains.
+        bytes_per_block = get_bytes_per_data_block(header)
+
+        # How many data blocks remain in this file?
+        data_present = False
+        bytes_remaining = filesize - fid.tell()
+        if bytes_remaining > 0:
+            data_present = True
+
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+
+        num_data_blocks = int(bytes_remaining / bytes_per_block)
+        num_amplifier_samples = header['num_samples_per_data_block'] * num_data_blocks
+        record_time = num_amplifier_samples / header['sample_rate']
+
+        if data_present:
+            log('File contains {:0.3f} seconds of data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(record_time, header['sample_rate'] / 1000))
+        else:
+            log('Header file contains no data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(header['sample_rate'] / 1000))
+
+        # Only the selected channels and streams are decoded; from here on header describes them.
+        file_header = header
+        header = select_channels(header, channels, streams, dig_lines)
+
+        data = []
+        if data_present:
+            log('')
+
+            # Read sampled data from file, converting it chunk by chunk.
+            log('Reading data from file...')
+            data = read_data_blocks(fid, file_header, num_data_blocks, channels, streams, dtype)
+
+            # Make sure we have read exactly the right amount of data.
+            bytes_remaining = filesize - fid.tell()
+            if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
+
+    if data_present:
+        log('Parsing data...')
+
+        if dtype is not None:
+            add_digital_lines(data, header)
+
+        # Check for gaps in timestamps, found while decoding.
+        num_gaps = len(data['timestamp_gaps'])
+        if num_gaps == 0:
+            log('No missing timestamps in data.')
+        else:
+            log('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
+
+        # Scale time steps (units = seconds).  The compact policies get lazy TimeAxis objects
+        # instead of float64 arrays.
+        if dtype is None:
+            data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
+            data['t_aux_input'] = data['t_amplifier'][::4]
+            data['t_supply_voltage'] = data['t_amplifier'][::header['num_samples_per_data_block']]
+        else:
+            first_timestamp = data['t_amplifier'][0] if len(data['t_amplifier']) > 0 else 0
+            data['t_amplifier'] = TimeAxis(first_timestamp, header['sample_rate'], len(data['t_amplifier']), data['timestamp_gaps'])
+            data['t_aux_input'] = data['t_amplifier'].decimate(4)
+            data['t_supply_voltage'] = data['t_amplifier'].decimate(header['num_samples_per_data_block'])
+        data['t_board_adc'] = data['t_amplifier']
+        data['t_dig'] = data['t_amplifier']
+        data['t_temp_sensor'] = data['t_supply_voltage']
+
+    return header, data, data_present
+
+
+def plural(n):
+    """Utility function to optionally pluralize words based on the value of n.
+    """
+
+    if n == 1:
+        return ''
+    else:
+        return 's'
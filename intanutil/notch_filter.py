@@ -4,8 +4,9 @@
 
 import math
 import numpy as np
+import scipy.signal as signal
 
-def notch_filter(input, fSample, fNotch, Bandwidth):
+def notch_filter(input, fSample, fNotch, Bandwidth, zi=None, return_zi=False):
     """Implements a notch filter (e.g., for 50 or 60 Hz) on vector 'input'.
 
     fSample = sample rate of data (input Hz or Samples/sec)
@@ -15,17 +16,25 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
     poor time-domain properties with an extended ringing response to
     transient disturbances.
 
+    input may also be 2-D (channels x samples); every row is filtered.
+
     Example:  If neural data was sampled at 30 kSamples/sec
     and you wish to implement a 60 Hz notch filter:
 
     out = notch_filter(input, 30000, 60, 10);
+
+    To filter a continuous data stream in chunks, pass return_zi=True to get the
+    filter state at the end of a chunk as well, and pass it as zi with the next
+    chunk; the output is the same as filtering the whole stream at once.  Without zi
+    the first two samples are passed through unfiltered and start the filter.
+
+    out, zi = notch_filter(chunk1, 30000, 60, 10, return_zi=True)
+    out, zi = notch_filter(chunk2, 30000, 60, 10, zi=zi, return_zi=True)
     """
 
     tstep = 1.0/fSample
     Fc = fNotch*tstep
 
-    L = len(input)
-
     # Calculate IIR filter parameters
     d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
     b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
@@ -37,14 +46,23 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
     b1 = -2.0 * math.cos(2.0*math.pi*Fc)
     b2 = 1.0
 
-    out = np.zeros(len(input))
-    out[0] = input[0]
-    out[1] = input[1]
-    # (If filtering a continuous data stream, change out[0:1] to the
-    #  previous final two values of out.)
+    # out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
+    num = np.array([a*b0, a*b1, a*b2]) / a0
+    den = np.array([1.0, a1/a0, a2/a0])
 
-    # Run filter
-    for i in range(2,L):
-        out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
+    x = np.asarray(input, dtype=np.float64)
+    if zi is None:
+        if x.shape[-1] < 2:
+            raise ValueError('At least two samples are needed to start the notch filter.')
+        # out[0:2] = input[0:2]; express that as the state of the recurrence after them.
+        x0 = x[..., 0]
+        x1 = x[..., 1]
+        zi = np.stack([num[1]*x1 - den[1]*x1 + num[2]*x0 - den[2]*x0, num[2]*x1 - den[2]*x1], axis=-1)
+        y, zi = signal.lfilter(num, den, x[..., 2:], axis=-1, zi=zi)
+        out = np.concatenate([x[..., :2], y], axis=-1)
+    else:
+        out, zi = signal.lfilter(num, den, x, axis=-1, zi=zi)
 
+    if return_zi:
+        return out, zi
     return out
@@ -3,12 +3,12 @@
 # Michael Gibson 23 April 2015
 
 
-import sys, struct, os
+import sys, struct
 
 def read_qstring(fid):
-    """Read Qt style QString.  
+    """Read Qt style QString.
 
-    The first 32-bit unsigned number indicates the length of the string (in bytes).  
+    The first 32-bit unsigned number indicates the length of the string (in bytes).
     If this number equals 0xFFFFFFFF, the string is null.
 
     Strings are stored as unicode.
@@ -17,25 +17,30 @@ def read_qstring(fid):
     length, = struct.unpack('<I', fid.read(4))
     if length == int('ffffffff', 16): return ""
 
-    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1) :
+    data = fid.read(length)
+    if len(data) < length:
         print(length)
         raise Exception('Length too long.')
 
-    # convert length from bytes to 16-bit Unicode words
-    length = int(length / 2)
-
-    data = []
-    for i in range(0, length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-
-    if sys.version_info >= (3,0):
-        a = ''.join([chr(c) for c in data])
-    else:
-        a = ''.join([unichr(c) for c in data])
-    
-    return a
-  
+    return data.decode('utf-16-le')
+
+
+def unpack_qstring(buffer, offset):
+    """Decodes a Qt style QString starting at offset in buffer (bytes).
+
+    Returns the string and the offset just past it.
+    """
+
+    length, = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    if length == int('ffffffff', 16): return "", offset
+
+    if offset + length > len(buffer):
+        print(length)
+        raise Exception('Length too long.')
+
+    return buffer[offset:offset + length].decode('utf-16-le'), offset + length
+
 if __name__ == '__main__':
     a=read_qstring(open(sys.argv[1], 'rb'))
     print(a)
@@ -0,0 +1,233 @@
+#! /bin/env python
+#
+# Whole-file decode of RHD2000 data blocks using a NumPy structured dtype.
+
+import numpy as np
+
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.convert_data import convert_streams
+
+
+def get_data_block_dtype(header):
+    """Builds a structured dtype describing the layout of one 60 or 128 sample data block.
+
+    Streams with no enabled channels are left out of the dtype.
+    """
+
+    n = header['num_samples_per_data_block']
+
+    # In version 1.2, we moved from saving timestamps as unsigned
+    # integers to signed integers to accommodate negative (adjusted)
+    # timestamps for pretrigger data.
+    if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+        fields = [('timestamps', '<i4', (n,))]
+    else:
+        fields = [('timestamps', '<u4', (n,))]
+
+    if header['num_amplifier_channels'] > 0:
+        fields.append(('amplifier', '<u2', (header['num_amplifier_channels'], n)))
+    if header['num_aux_input_channels'] > 0:
+        fields.append(('aux_input', '<u2', (header['num_aux_input_channels'], n // 4)))
+    if header['num_supply_voltage_channels'] > 0:
+        fields.append(('supply_voltage', '<u2', (header['num_supply_voltage_channels'],)))
+    if header['num_temp_sensor_channels'] > 0:
+        fields.append(('temp_sensor', '<u2', (header['num_temp_sensor_channels'],)))
+    if header['num_board_adc_channels'] > 0:
+        fields.append(('board_adc', '<u2', (header['num_board_adc_channels'], n)))
+    if header['num_board_dig_in_channels'] > 0:
+        fields.append(('board_dig_in', '<u2', (n,)))
+    if header['num_board_dig_out_channels'] > 0:
+        fields.append(('board_dig_out', '<u2', (n,)))
+
+    block_dtype = np.dtype(fields)
+    if block_dtype.itemsize != get_bytes_per_data_block(header):
+        raise Exception('Data block dtype does not match the expected number of bytes per block.')
+    return block_dtype
+
+
+# Streams that can be selected with the streams argument, in block order.
+STREAMS = ('amplifier', 'aux_input', 'supply_voltage', 'temp_sensor', 'board_adc', 'board_dig_in', 'board_dig_out')
+
+
+def select_channels(header, channels=None, streams=None, dig_lines=None):
+    """Returns a copy of header listing only the selected channels and streams.
+
+    channels are indices into header['amplifier_channels'], dig_lines indices into
+    header['board_dig_in_channels'] and streams a subset of STREAMS; None keeps
+    everything.  The copy describes the decoded data, not the file layout, so it must
+    not be used to compute block sizes.
+    """
+
+    if streams is not None:
+        for stream in streams:
+            if stream not in STREAMS:
+                raise ValueError('Unknown stream {!r}; expected one of {}'.format(stream, STREAMS))
+
+    selected = dict(header)
+    for stream in STREAMS:
+        if streams is not None and stream not in streams:
+            if stream != 'temp_sensor':
+                selected[stream + '_channels'] = []
+            if stream == 'amplifier':
+                selected['spike_triggers'] = []
+            selected['num_' + stream + '_channels'] = 0
+        elif stream == 'amplifier' and channels is not None:
+            selected['amplifier_channels'] = [header['amplifier_channels'][i] for i in channels]
+            selected['spike_triggers'] = [header['spike_triggers'][i] for i in channels]
+            selected['num_amplifier_channels'] = len(channels)
+        elif stream == 'board_dig_in' and dig_lines is not None:
+            selected['board_dig_in_channels'] = [header['board_dig_in_channels'][i] for i in dig_lines]
+            selected['num_board_dig_in_channels'] = len(dig_lines)
+    return selected
+
+
+def data_blocks_to_arrays(blocks, header, channels=None, streams=None):
+    """De-interleaves an array of data blocks into per-stream arrays.
+
+    blocks is an array (or memmap) with the dtype from get_data_block_dtype.  The
+    returned dictionary uses the same keys and layout as the per-block readers:
+    [num_channels, num_samples] arrays for each stream, plus 1-D timestamps and raw
+    digital words.  Samples are left in their native integer types.
+
+    channels (amplifier channel indices) and streams (see STREAMS) restrict what is
+    decoded; streams that are not requested come back with no channels.  Only the
+    selected rows of each block are copied, so with a memmap the cost scales with the
+    selection rather than with the number of channels in the file.
+    """
+
+    n = header['num_samples_per_data_block']
+    num_blocks = blocks.shape[0]
+    blocks = np.asarray(blocks)
+    names = blocks.dtype.names
+
+    def wanted(name):
+        return streams is None or name in streams
+
+    def multi(name, num_channels, samples_per_block, selection=None):
+        if not wanted(name):
+            return np.zeros([0, samples_per_block * num_blocks], dtype=np.uint16)
+        if name not in names:
+            return np.zeros([num_channels, samples_per_block * num_blocks], dtype=np.uint16)
+        field = blocks[name]
+        if selection is not None:
+            field = field[:, selection, :]
+        # (blocks, channels, samples) -> (channels, blocks * samples)
+        return field.transpose(1, 0, 2).reshape(field.shape[1], samples_per_block * num_blocks)
+
+    def single(name, num_channels):
+        if not wanted(name):
+            return np.zeros([0, num_blocks], dtype=np.uint16)
+        if name not in names:
+            return np.zeros([num_channels, num_blocks], dtype=np.uint16)
+        return np.ascontiguousarray(blocks[name].T)
+
+    def word(name):
+        if not wanted(name):
+            return np.zeros(0, dtype=np.uint16)
+        if name not in names:
+            return np.zeros(n * num_blocks, dtype=np.uint16)
+        return blocks[name].reshape(-1)
+
+    data = {}
+    data['t_amplifier'] = blocks['timestamps'].reshape(-1)
+    data['amplifier_data'] = multi('amplifier', header['num_amplifier_channels'], n, channels)
+    data['aux_input_data'] = multi('aux_input', header['num_aux_input_channels'], n // 4)
+    data['supply_voltage_data'] = single('supply_voltage', header['num_supply_voltage_channels'])
+    data['temp_sensor_data'] = single('temp_sensor', header['num_temp_sensor_channels'])
+    data['board_adc_data'] = multi('board_adc', header['num_board_adc_channels'], n)
+    data['board_dig_in_raw'] = word('board_dig_in')
+    data['board_dig_out_raw'] = word('board_dig_out')
+
+    return data
+
+
+# Bytes of data blocks decoded at a time by read_data_blocks.
+DECODE_CHUNK_BYTES = 1 << 22
+
+
+def read_data_blocks(fid, header, num_data_blocks, channels=None, streams=None, dtype=None, chunk_bytes=DECODE_CHUNK_BYTES):
+    """Reads num_data_blocks data blocks from the current position of fid.
+
+    The blocks are decoded about chunk_bytes at a time into arrays allocated up front for
+    the whole file, so peak memory is the size of the output plus one chunk.  With no
+    selection each chunk is read with np.fromfile; when channels or streams are given it
+    is memory-mapped instead and only the selected parts of each block are copied out
+    (see data_blocks_to_arrays).  dtype is a policy from
+    intanutil.convert_data.DTYPE_POLICIES applied to each chunk with convert_streams;
+    None leaves the samples as stored in the file.  The gaps in the timestamps are found
+    as each chunk is decoded and returned as 'timestamp_gaps' (see find_timestamp_gaps).
+    """
+
+    num_data_blocks = int(num_data_blocks)
+    block_dtype = get_data_block_dtype(header)
+    blocks_per_chunk = max(1, chunk_bytes // block_dtype.itemsize)
+    offset = fid.tell()
+
+    data = None
+    gaps = []
+    previous = None
+    for first in range(0, max(num_data_blocks, 1), blocks_per_chunk):
+        count = min(blocks_per_chunk, num_data_blocks - first)
+        if count == 0:
+            blocks = np.zeros(0, dtype=block_dtype)
+        elif channels is None and streams is None:
+            blocks = np.fromfile(fid, dtype=block_dtype, count=count)
+            if blocks.shape[0] != count:
+                raise Exception('Error: End of file reached before all data blocks were read.')
+        else:
+            blocks = np.memmap(fid, dtype=block_dtype, mode='r', offset=offset + first * block_dtype.itemsize, shape=(count,))
+        chunk = data_blocks_to_arrays(blocks, header, channels, streams)
+        del blocks
+        if dtype is not None:
+            convert_streams(chunk, header, dtype)
+        gaps.append(find_timestamp_gaps(chunk['t_amplifier'], previous, first * header['num_samples_per_data_block']))
+        if count > 0:
+            previous = chunk['t_amplifier'][-1]
+
+        if count == num_data_blocks:
+            data = chunk
+            break
+        if data is None:
+            # every stream has a fixed number of samples per block along its last axis
+            data = {key: np.empty(x.shape[:-1] + (x.shape[-1] // count * num_data_blocks,), dtype=x.dtype) for key, x in chunk.items()}
+        for key, x in chunk.items():
+            samples = x.shape[-1] // count
+            data[key][..., first * samples:(first + count) * samples] = x
+
+    fid.seek(offset + num_data_blocks * block_dtype.itemsize)
+    data['timestamp_gaps'] = np.concatenate(gaps)
+    return data
+
+
+# Timestamps are compared this many samples at a time, so the temporaries stay small.
+GAP_SCAN_SIZE = 1 << 20
+
+
+def find_timestamp_gaps(timestamps, previous=None, first_sample=0):
+    """Returns the gaps in a timestamp stream as an int64 array of (sample, expected, actual) rows.
+
+    A gap is a sample whose timestamp is not one more than the timestamp before it;
+    sample is its index counted from first_sample.  When timestamps is one chunk of a
+    longer stream, previous is the last timestamp of the preceding chunk, so gaps at the
+    chunk boundary are found too.
+    """
+
+    timestamps = np.asarray(timestamps)
+    index = []
+    if previous is not None and len(timestamps) > 0 and int(timestamps[0]) != int(previous) + 1:
+        index.append(np.zeros(1, dtype=np.intp))
+    for start in range(0, len(timestamps) - 1, GAP_SCAN_SIZE):
+        t = timestamps[start:start + GAP_SCAN_SIZE + 1]
+        index.append(np.flatnonzero(t[1:] - t[:-1] != 1) + (start + 1))
+    index = np.concatenate(index) if index else np.zeros(0, dtype=np.intp)
+
+    gaps = np.zeros([len(index), 3], dtype=np.int64)
+    if len(index) > 0:
+        actual = timestamps[index].astype(np.int64)
+        expected = timestamps[np.maximum(index - 1, 0)].astype(np.int64) + 1
+        if previous is not None and index[0] == 0:
+            expected[0] = int(previous) + 1
+        gaps[:, 0] = index + first_sample
+        gaps[:, 1] = expected
+        gaps[:, 2] = actual
+    return gaps
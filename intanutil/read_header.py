@@ -4,37 +4,103 @@
 # Modified Adrian Foy Sep 2018
 
 import sys, struct
-from intanutil.qstring import read_qstring
+from intanutil.qstring import unpack_qstring
+
+# The header is read into memory in one piece; this is enough for several hundred channels
+# and is grown if a header turns out to be longer.
+HEADER_READ_SIZE = 65536
+
+MAGIC_NUMBER = struct.Struct('<I')
+VERSION = struct.Struct('<hh')
+SAMPLE_RATE = struct.Struct('<f')
+FREQUENCY_SETTINGS = struct.Struct('<hffffff')
+INT16 = struct.Struct('<h')
+IMPEDANCE_TEST_FREQUENCY = struct.Struct('<ff')
+SIGNAL_GROUP = struct.Struct('<hhh')
+# native_order, custom_order, signal_type, channel_enabled, chip_channel, board_stream,
+# voltage_trigger_mode, voltage_threshold, digital_trigger_channel, digital_edge_polarity,
+# electrode_impedance_magnitude, electrode_impedance_phase
+CHANNEL = struct.Struct('<hhhhhhhhhhff')
+
+
+class HeaderTruncated(Exception):
+    """Raised by parse_header when the buffer ends before the header does."""
+
+
+def read_header(fid, quiet=False):
+    """Reads the Intan File Format header from the given file.
+
+    The header is read in one buffer and decoded from memory; on return fid is positioned
+    at the start of the data blocks.  quiet suppresses the printed summary.
+    """
+
+    start = fid.tell()
+    buffer = fid.read(HEADER_READ_SIZE)
+    while True:
+        try:
+            header, header_size = parse_header(buffer)
+            break
+        except HeaderTruncated:
+            more = fid.read(len(buffer))
+            if not more:
+                raise Exception('Unexpected end of file while reading header.')
+            buffer += more
+    fid.seek(start + header_size)
+
+    if not quiet:
+        print('')
+        print('Reading Intan Technologies RHD2000 Data File, Version {}.{}'.format(header['version']['major'], header['version']['minor']))
+        print('')
 
-def read_header(fid):
-    """Reads the Intan File Format header from the given file."""
+    return header
+
+
+def parse_header(buffer, offset=0):
+    """Parses the Intan File Format header from bytes, starting at offset.
+
+    Returns the header dictionary and the offset of the first data block.
+    """
+
+    def unpack(s):
+        nonlocal offset
+        if offset + s.size > len(buffer):
+            raise HeaderTruncated()
+        values = s.unpack_from(buffer, offset)
+        offset += s.size
+        return values
+
+    def qstring():
+        nonlocal offset
+        if offset + 4 > len(buffer):
+            raise HeaderTruncated()
+        length, = struct.unpack_from('<I', buffer, offset)
+        if length != int('ffffffff', 16) and offset + 4 + length > len(buffer):
+            raise HeaderTruncated()
+        s, offset = unpack_qstring(buffer, offset)
+        return s
 
     # Check 'magic number' at beginning of file to make sure this is an Intan
     # Technologies RHD2000 data file.
-    magic_number, = struct.unpack('<I', fid.read(4)) 
+    magic_number, = unpack(MAGIC_NUMBER)
     if magic_number != int('c6912702', 16): raise Exception('Unrecognized file type.')
 
     header = {}
     # Read version number.
     version = {}
-    (version['major'], version['minor']) = struct.unpack('<hh', fid.read(4)) 
+    (version['major'], version['minor']) = unpack(VERSION)
     header['version'] = version
 
-    print('')
-    print('Reading Intan Technologies RHD2000 Data File, Version {}.{}'.format(version['major'], version['minor']))
-    print('')
-
     freq = {}
 
     # Read information of sampling rate and amplifier frequency settings.
-    header['sample_rate'], = struct.unpack('<f', fid.read(4))
-    (freq['dsp_enabled'], freq['actual_dsp_cutoff_frequency'], freq['actual_lower_bandwidth'], freq['actual_upper_bandwidth'], 
-    freq['desired_dsp_cutoff_frequency'], freq['desired_lower_bandwidth'], freq['desired_upper_bandwidth']) = struct.unpack('<hffffff', fid.read(26))
+    header['sample_rate'], = unpack(SAMPLE_RATE)
+    (freq['dsp_enabled'], freq['actual_dsp_cutoff_frequency'], freq['actual_lower_bandwidth'], freq['actual_upper_bandwidth'],
+    freq['desired_dsp_cutoff_frequency'], freq['desired_lower_bandwidth'], freq['desired_upper_bandwidth']) = unpack(FREQUENCY_SETTINGS)
 
 
     # This tells us if a software 50/60 Hz notch filter was enabled during
     # the data acquisition.
-    notch_filter_mode, = struct.unpack('<h', fid.read(2))
+    notch_filter_mode, = unpack(INT16)
     header['notch_filter_frequency'] = 0
     if notch_filter_mode == 1:
         header['notch_filter_frequency'] = 50
@@ -42,28 +108,28 @@ def read_header(fid):
         header['notch_filter_frequency'] = 60
     freq['notch_filter_frequency'] = header['notch_filter_frequency']
 
-    (freq['desired_impedance_test_frequency'], freq['actual_impedance_test_frequency']) = struct.unpack('<ff', fid.read(8))
+    (freq['desired_impedance_test_frequency'], freq['actual_impedance_test_frequency']) = unpack(IMPEDANCE_TEST_FREQUENCY)
 
-    note1 = read_qstring(fid)
-    note2 = read_qstring(fid)
-    note3 = read_qstring(fid)
+    note1 = qstring()
+    note2 = qstring()
+    note3 = qstring()
     header['notes'] = { 'note1' : note1, 'note2' : note2, 'note3' : note3}
 
     # If data file is from GUI v1.1 or later, see if temperature sensor data was saved.
     header['num_temp_sensor_channels'] = 0
     if (version['major'] == 1 and version['minor'] >= 1) or (version['major'] > 1) :
-        header['num_temp_sensor_channels'], = struct.unpack('<h', fid.read(2))
-        
+        header['num_temp_sensor_channels'], = unpack(INT16)
+
     # If data file is from GUI v1.3 or later, load eval board mode.
     header['eval_board_mode'] = 0
     if ((version['major'] == 1) and (version['minor'] >= 3)) or (version['major'] > 1) :
-        header['eval_board_mode'], = struct.unpack('<h', fid.read(2))
-        
-        
+        header['eval_board_mode'], = unpack(INT16)
+
+
     header['num_samples_per_data_block'] = 60
     # If data file is from v2.0 or later (Intan Recording Controller), load name of digital reference channel
     if (version['major'] > 1):
-        header['reference_channel'] = read_qstring(fid)
+        header['reference_channel'] = qstring()
         header['num_samples_per_data_block'] = 128
 
     # Place frequency-related information in data structure. (Note: much of this structure is set above)
@@ -86,23 +152,22 @@ def read_header(fid):
 
     # Read signal summary from data file header.
 
-    number_of_signal_groups, = struct.unpack('<h', fid.read(2))
-    print('n signal groups {}'.format(number_of_signal_groups))
+    number_of_signal_groups, = unpack(INT16)
 
     for signal_group in range(1, number_of_signal_groups + 1):
-        signal_group_name = read_qstring(fid)
-        signal_group_prefix = read_qstring(fid)
-        (signal_group_enabled, signal_group_num_channels, signal_group_num_amp_channels) = struct.unpack('<hhh', fid.read(6))
+        signal_group_name = qstring()
+        signal_group_prefix = qstring()
+        (signal_group_enabled, signal_group_num_channels, signal_group_num_amp_channels) = unpack(SIGNAL_GROUP)
 
         if (signal_group_num_channels > 0) and (signal_group_enabled > 0):
             for signal_channel in range(0, signal_group_num_channels):
                 new_channel = {'port_name' : signal_group_name, 'port_prefix' : signal_group_prefix, 'port_number' : signal_group}
-                new_channel['native_channel_name'] = read_qstring(fid)
-                new_channel['custom_channel_name'] = read_qstring(fid)
-                (new_channel['native_order'], new_channel['custom_order'], signal_type, channel_enabled, new_channel['chip_channel'], new_channel['board_stream']) = struct.unpack('<hhhhhh', fid.read(12))
+                new_channel['native_channel_name'] = qstring()
+                new_channel['custom_channel_name'] = qstring()
                 new_trigger_channel = {}
-                (new_trigger_channel['voltage_trigger_mode'], new_trigger_channel['voltage_threshold'], new_trigger_channel['digital_trigger_channel'], new_trigger_channel['digital_edge_polarity'])  = struct.unpack('<hhhh', fid.read(8))
-                (new_channel['electrode_impedance_magnitude'], new_channel['electrode_impedance_phase']) = struct.unpack('<ff', fid.read(8))
+                (new_channel['native_order'], new_channel['custom_order'], signal_type, channel_enabled, new_channel['chip_channel'], new_channel['board_stream'],
+                 new_trigger_channel['voltage_trigger_mode'], new_trigger_channel['voltage_threshold'], new_trigger_channel['digital_trigger_channel'], new_trigger_channel['digital_edge_polarity'],
+                 new_channel['electrode_impedance_magnitude'], new_channel['electrode_impedance_phase']) = unpack(CHANNEL)
 
                 if channel_enabled:
                     if signal_type == 0:
@@ -120,7 +185,7 @@ def read_header(fid):
                         header['board_dig_out_channels'].append(new_channel)
                     else:
                         raise Exception('Unknown channel type.')
-                        
+
     # Summarize contents of data file.
     header['num_amplifier_channels'] = len(header['amplifier_channels'])
     header['num_aux_input_channels'] = len(header['aux_input_channels'])
@@ -129,7 +194,7 @@ def read_header(fid):
     header['num_board_dig_in_channels'] = len(header['board_dig_in_channels'])
     header['num_board_dig_out_channels'] = len(header['board_dig_out_channels'])
 
-    return header
+    return header, offset
 
 if __name__ == '__main__':
     h=read_header(open(sys.argv[1], 'rb'))
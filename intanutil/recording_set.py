@@ -0,0 +1,190 @@
+#! /bin/env python
+#
+# Several RHD2000 files presented as one recording.
+
+import numpy as np
+
+from intanutil.rhd_recording import RhdRecording
+from intanutil.convert_data import DigitalLines
+
+
+# Streams besides the amplifier whose channels are compared between the files of a set.
+CHANNEL_STREAMS = ('aux_input', 'board_adc', 'board_dig_in', 'board_dig_out')
+
+
+def get_channel_names(header, stream):
+    """Returns the native channel names of stream in header."""
+    return [c['native_channel_name'] for c in header[stream + '_channels']]
+
+
+class RecordingSet(object):
+    """Presents an ordered list of RHD2000 data files as one continuous recording.
+
+    Each file is memory-mapped as an RhdRecording; samples are addressed by a global
+    index running through the files in order, e.g.
+
+        recs = RecordingSet(['a.rhd', 'b.rhd', 'c.rhd'])
+        x = recs.amplifier[:, 100000:300000]    # may span the end of a.rhd and start of b.rhd
+
+    Only the files (and data blocks) overlapping the requested samples are read, and
+    nothing is concatenated up front.  All files must have the same number of amplifier
+    channels and the same sample rate.  The aux, ADC and digital channels of the files are
+    compared as well; a stream whose channels differ between files is listed in
+    mixed_streams and can only be read file by file, from recordings.
+    """
+
+    def __init__(self, filenames, use_cache=False, cache_dir=None):
+        """use_cache and cache_dir are passed on to RhdRecording."""
+
+        self.filenames = list(filenames)
+        if not self.filenames:
+            raise ValueError('A RecordingSet needs at least one file.')
+        self.recordings = [RhdRecording(f, use_cache, cache_dir) for f in self.filenames]
+
+        self.header = self.recordings[0].header
+        self.sample_rate = self.recordings[0].sample_rate
+        for rec in self.recordings[1:]:
+            if rec.header['num_amplifier_channels'] != self.header['num_amplifier_channels']:
+                raise Exception('{} has {} amplifier channels, {} has {}.'.format(rec.filename, rec.header['num_amplifier_channels'],
+                                                                              self.filenames[0], self.header['num_amplifier_channels']))
+            if rec.sample_rate != self.sample_rate:
+                raise Exception('{} was sampled at {} Hz, {} at {} Hz.'.format(rec.filename, rec.sample_rate, self.filenames[0], self.sample_rate))
+
+        # Streams whose channels differ between files, with the reason.
+        self.mixed_streams = {}
+        for stream in CHANNEL_STREAMS:
+            names = get_channel_names(self.header, stream)
+            for rec in self.recordings[1:]:
+                if get_channel_names(rec.header, stream) != names:
+                    self.mixed_streams[stream] = '{} has {} channels {}, {} has {}.'.format(rec.filename, stream, get_channel_names(rec.header, stream),
+                                                                                        self.filenames[0], names)
+                    break
+
+        # Global amplifier sample index of the first sample of each file, and the total.
+        self.file_starts = np.cumsum([0] + [rec.num_samples for rec in self.recordings], dtype=np.int64)
+        self.num_samples = int(self.file_starts[-1])
+
+        self.timestamps = SetStreamView(self, 'timestamps')
+        self.amplifier = SetStreamView(self, 'amplifier')
+        self.aux_input = SetStreamView(self, 'aux_input', self.mixed_streams.get('aux_input'))
+        self.board_adc = SetStreamView(self, 'board_adc', self.mixed_streams.get('board_adc'))
+        self.board_dig_in_raw = SetStreamView(self, 'board_dig_in_raw', self.mixed_streams.get('board_dig_in'))
+        self.board_dig_out_raw = SetStreamView(self, 'board_dig_out_raw', self.mixed_streams.get('board_dig_out'))
+        self.board_dig_in = DigitalLines(self.board_dig_in_raw, self.header['board_dig_in_channels'])
+        self.board_dig_out = DigitalLines(self.board_dig_out_raw, self.header['board_dig_out_channels'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Releases the memory maps of all files."""
+        for rec in self.recordings:
+            rec.close()
+
+    def __repr__(self):
+        return 'RecordingSet({} files, {} samples, {} amplifier channels)'.format(len(self.recordings), self.num_samples, self.header['num_amplifier_channels'])
+
+    def locate(self, sample):
+        """Returns (file index, sample index within that file) of global amplifier sample."""
+
+        if sample < 0 or sample >= self.num_samples:
+            raise IndexError('Sample index {} out of range.'.format(sample))
+        i = int(np.searchsorted(self.file_starts, sample, side='right')) - 1
+        return i, int(sample - self.file_starts[i])
+
+
+class SetStreamView(object):
+    """One stream of a RecordingSet, indexed like the StreamView of each file but with a global sample index."""
+
+    def __init__(self, recording_set, name, mixed=None):
+        """mixed is the reason the stream cannot be read across the files, if it cannot."""
+        self.views = [getattr(rec, name) for rec in recording_set.recordings]
+        self.mixed = mixed
+        self.num_channels = self.views[0].num_channels
+        self.starts = np.cumsum([0] + [view.num_samples for view in self.views], dtype=np.int64)
+
+    @property
+    def num_samples(self):
+        return int(self.starts[-1])
+
+    @property
+    def shape(self):
+        if self.num_channels is None:
+            return (self.num_samples,)
+        return (self.num_channels, self.num_samples)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        a = self[...]
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def __getitem__(self, key):
+        if self.mixed is not None:
+            raise Exception('The files of the set differ in their channels: ' + self.mixed)
+        if self.num_channels is None:
+            channels = None
+            t_key = key
+        else:
+            if not isinstance(key, tuple):
+                key = (key, slice(None))
+            if len(key) != 2:
+                raise IndexError('Index as view[channels, samples].')
+            channels, t_key = key
+        if t_key is Ellipsis:
+            t_key = slice(None)
+
+        def get(view, local):
+            return view[local] if channels is None else view[channels, local]
+
+        num_samples = self.num_samples
+        if isinstance(t_key, (int, np.integer)):
+            if t_key < -num_samples or t_key >= num_samples:
+                raise IndexError('Sample index {} out of range.'.format(t_key))
+            t_key = t_key % num_samples
+            i = int(np.searchsorted(self.starts, t_key, side='right')) - 1
+            return get(self.views[i], int(t_key - self.starts[i]))
+
+        pieces = []
+        if isinstance(t_key, slice) and t_key.indices(num_samples)[2] > 0:
+            start, stop, step = t_key.indices(num_samples)
+            for view, file_start, file_stop in zip(self.views, self.starts[:-1], self.starts[1:]):
+                lo = max(start, file_start)
+                lo += (start - lo) % step
+                hi = min(stop, file_stop)
+                if lo < hi:
+                    pieces.append(get(view, slice(int(lo - file_start), int(hi - file_start), step)))
+        else:
+            if isinstance(t_key, slice):
+                index = np.arange(*t_key.indices(num_samples))
+            else:
+                index = np.asarray(t_key)
+                if index.dtype == bool:
+                    index = np.flatnonzero(index)
+                index = np.where(index < 0, index + num_samples, index).astype(np.int64)
+                if np.any((index < 0) | (index >= num_samples)):
+                    raise IndexError('Sample index out of range.')
+            # Runs of consecutive indices into the same file are read together.
+            files = np.searchsorted(self.starts, index, side='right') - 1
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(files)) + 1, [len(index)]))
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                if lo < hi:
+                    i = files[lo]
+                    pieces.append(get(self.views[i], index[lo:hi] - self.starts[i]))
+
+        if not pieces:
+            return get(self.views[0], slice(0, 0))
+        return np.concatenate(pieces, axis=-1)
+
+    def iter_chunks(self, samples_per_chunk=1 << 16):
+        """Yields (first sample, data) for consecutive chunks of at most samples_per_chunk samples, over all files."""
+
+        for start in range(0, self.num_samples, samples_per_chunk):
+            stop = min(start + samples_per_chunk, self.num_samples)
+            yield start, self[start:stop] if self.num_channels is None else self[:, start:stop]
@@ -0,0 +1,198 @@
+#! /bin/env python
+#
+# Lazy, memory-mapped access to the data blocks of an RHD2000 file.
+
+import os
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.read_data_blocks import get_data_block_dtype
+from intanutil.header_cache import get_recording_info
+from intanutil.convert_data import DigitalLines
+
+
+class RhdRecording(object):
+    """Memory-maps an Intan Technologies RHD2000 data file and decodes streams on demand.
+
+    Each stream is exposed as an indexable view, e.g.
+
+        rec = RhdRecording('recording.rhd')
+        x = rec.amplifier[0:8, 20000:40000]     # channels 0-7, samples 20000-39999
+        d = rec.board_dig_in[0, :]              # digital line 0 as booleans
+
+    Only the data blocks overlapping the requested samples are read from disk.
+    Amplifier, aux, supply, temperature and ADC samples are returned as the raw
+    uint16 values stored in the file; timestamps as int32 (uint32 before v1.2).
+    """
+
+    def __init__(self, filename, use_cache=False, cache_dir=None):
+        """use_cache takes the header from the sidecar cache (see intanutil.header_cache),
+        stored next to the file or in cache_dir."""
+
+        self.filename = filename
+        if use_cache:
+            info = get_recording_info(filename, cache_dir)
+            self.header = info['header']
+            self.data_offset = info['data_offset']
+        else:
+            with open(filename, 'rb') as fid:
+                self.header = read_header(fid, quiet=True)
+                self.data_offset = fid.tell()
+
+        header = self.header
+        self.bytes_per_block = get_bytes_per_data_block(header)
+        bytes_remaining = os.path.getsize(filename) - self.data_offset
+        if bytes_remaining % self.bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+
+        self.num_data_blocks = int(bytes_remaining // self.bytes_per_block)
+        self.samples_per_block = header['num_samples_per_data_block']
+        self.num_samples = self.samples_per_block * self.num_data_blocks
+        self.sample_rate = header['sample_rate']
+        self.block_dtype = get_data_block_dtype(header)
+
+        if self.num_data_blocks > 0:
+            self._blocks = np.memmap(filename, dtype=self.block_dtype, mode='r', offset=self.data_offset, shape=(self.num_data_blocks,))
+        else:
+            self._blocks = np.zeros(0, dtype=self.block_dtype)
+
+        n = self.samples_per_block
+        self.timestamps = StreamView(self, 'timestamps', None, n)
+        self.amplifier = StreamView(self, 'amplifier', header['num_amplifier_channels'], n)
+        self.aux_input = StreamView(self, 'aux_input', header['num_aux_input_channels'], n // 4)
+        self.supply_voltage = StreamView(self, 'supply_voltage', header['num_supply_voltage_channels'], 1)
+        self.temp_sensor = StreamView(self, 'temp_sensor', header['num_temp_sensor_channels'], 1)
+        self.board_adc = StreamView(self, 'board_adc', header['num_board_adc_channels'], n)
+        self.board_dig_in_raw = StreamView(self, 'board_dig_in', None, n)
+        self.board_dig_out_raw = StreamView(self, 'board_dig_out', None, n)
+        self.board_dig_in = DigitalLines(self.board_dig_in_raw, header['board_dig_in_channels'])
+        self.board_dig_out = DigitalLines(self.board_dig_out_raw, header['board_dig_out_channels'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Releases the memory map."""
+        self._blocks = np.zeros(0, dtype=self.block_dtype)
+        self.num_data_blocks = 0
+        self.num_samples = 0
+
+    def __repr__(self):
+        return 'RhdRecording({!r}, {} blocks, {} amplifier channels)'.format(self.filename, self.num_data_blocks, self.header['num_amplifier_channels'])
+
+    def _decode(self, name, samples_per_block, channels, t_index):
+        """Decodes samples t_index (slice or integer array) of stream name for the given channels.
+
+        Returns [num_channels, num_samples] for channel streams, or [num_samples] when channels is None.
+        """
+
+        if isinstance(t_index, slice):
+            start, stop, step = t_index.indices(samples_per_block * self.num_data_blocks)
+            if step > 0:
+                if stop <= start:
+                    start = stop = 0
+                first = start // samples_per_block
+                last = -(-stop // samples_per_block)
+                local = slice(start - first * samples_per_block, stop - first * samples_per_block, step)
+            else:
+                t_index = np.arange(start, stop, step)
+        if not isinstance(t_index, slice):
+            if len(t_index) == 0:
+                first = last = 0
+            else:
+                first = int(t_index.min()) // samples_per_block
+                last = int(t_index.max()) // samples_per_block + 1
+            local = t_index - first * samples_per_block
+
+        if name not in self.block_dtype.names:
+            # Stream with no enabled channels.
+            width = (last - first) * samples_per_block
+            if channels is None:
+                return np.zeros(width, dtype=np.uint16)[local]
+            return np.zeros([0, width], dtype=np.uint16)[:, local]
+
+        field = self._blocks[first:last][name]
+        if channels is None:
+            return np.asarray(field).reshape(-1)[local]
+
+        if field.ndim == 2:
+            # Streams sampled once per block: (blocks, channels) -> (blocks, channels, 1)
+            field = field[:, :, np.newaxis]
+        field = np.asarray(field[:, channels, :])
+        # (blocks, channels, samples) -> (channels, blocks * samples)
+        return field.transpose(1, 0, 2).reshape(field.shape[1], field.shape[0] * field.shape[2])[:, local]
+
+
+class StreamView(object):
+    """Indexable view of one stream of an RhdRecording.
+
+    Channel streams are indexed as view[channels, samples]; single-channel
+    streams (timestamps, raw digital words) as view[samples].
+    """
+
+    def __init__(self, recording, name, num_channels, samples_per_block):
+        self.recording = recording
+        self.name = name
+        self.num_channels = num_channels
+        self.samples_per_block = samples_per_block
+
+    @property
+    def num_samples(self):
+        return self.samples_per_block * self.recording.num_data_blocks
+
+    @property
+    def shape(self):
+        if self.num_channels is None:
+            return (self.num_samples,)
+        return (self.num_channels, self.num_samples)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        a = self[...]
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def __getitem__(self, key):
+        if self.num_channels is None:
+            channels = None
+            t_key = key
+        else:
+            if not isinstance(key, tuple):
+                key = (key, slice(None))
+            if len(key) != 2:
+                raise IndexError('Index as view[channels, samples].')
+            channels, t_key = key
+            if channels is Ellipsis:
+                channels = slice(None)
+        if t_key is Ellipsis:
+            t_key = slice(None)
+
+        squeeze_channel = isinstance(channels, (int, np.integer))
+        if squeeze_channel and self.num_channels > 0:
+            channels = [channels]
+        squeeze_time = isinstance(t_key, (int, np.integer))
+        if squeeze_time:
+            num_samples = self.num_samples
+            if t_key < -num_samples or t_key >= num_samples:
+                raise IndexError('Sample index {} out of range.'.format(t_key))
+            t_key = slice(t_key % num_samples, t_key % num_samples + 1)
+        elif not isinstance(t_key, slice):
+            t_key = np.asarray(t_key)
+            if t_key.dtype == bool:
+                t_key = np.flatnonzero(t_key)
+            t_key = t_key.astype(np.intp)
+            t_key = np.where(t_key < 0, t_key + self.num_samples, t_key)
+
+        out = self.recording._decode(self.name, self.samples_per_block, channels, t_key)
+        if squeeze_time:
+            out = out[..., 0]
+        if squeeze_channel:
+            out = out[0]
+        return out
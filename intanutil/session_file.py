@@ -0,0 +1,271 @@
+#! /bin/env python
+#
+# One HDF5 file per recording session holding the auxiliary streams of all its RHD2000 files.
+
+import os
+import shutil
+import numpy as np
+import h5py
+
+from intanutil.convert_data import DigitalLines
+
+SESSION_VERSION = 2
+
+# Samples per HDF5 chunk along time; one chunk of every stream is written at a time.
+SESSION_CHUNK = 1 << 16
+
+# Stream name -> (RhdRecording view, amplifier samples per stream sample).
+SESSION_STREAMS = {'timestamps': ('timestamps', 1),
+                   'board_dig_in': ('board_dig_in_raw', 1),
+                   'board_dig_out': ('board_dig_out_raw', 1),
+                   'aux_input': ('aux_input', 4),
+                   'board_adc': ('board_adc', 1)}
+
+# Streams whose channels may differ between the files of a session.
+CHANNEL_STREAMS = ('aux_input', 'board_adc', 'board_dig_in', 'board_dig_out')
+
+
+def get_stream_scale(header, stream):
+    """Returns (scale, offset) turning raw samples of stream into volts as (raw - offset) * scale, or None if it has no units."""
+
+    if stream == 'aux_input':
+        return 37.4e-6, 0
+    if stream == 'board_adc':
+        if header['eval_board_mode'] == 1:
+            return 152.59e-6, 32768
+        elif header['eval_board_mode'] == 13:
+            return 312.5e-6, 32768
+        return 50.354e-6, 0
+    return None
+
+
+def get_session_version(filename):
+    """Returns the version of write_session that wrote filename."""
+
+    with h5py.File(filename, 'r') as f:
+        return int(f.attrs['session_version'])
+
+
+def write_session(recordings, filename, append=False, samples_per_chunk=SESSION_CHUNK):
+    """Writes the timestamps, digital words, aux inputs and board ADC inputs of a RecordingSet to one HDF5 file.
+
+    Each stream is one chunked, compressed dataset indexed by sample, so any time range
+    of any stream can be read without touching the others (see SessionFile).  The
+    digital inputs and outputs are kept as the raw uint16 words with a bit per line,
+    aux and ADC inputs as the raw uint16 samples with their scale to volts as attributes.
+    'file_starts' holds the first amplifier sample of each RHD file and the total.
+
+    The files may differ in their aux, ADC and digital channels: each stream holds every
+    channel of any file, by native channel name, a channel reads zero in the files
+    without it, and 'channels_present/<stream>' marks the channels of each file.
+
+    With append the files of the set are added after those filename already holds.
+    The session is written to a temporary file (a copy of filename with append) that only
+    replaces filename once it is complete.
+    Returns the number of amplifier samples written.
+    """
+
+    tmp_filename = filename + '.tmp'
+    if append:
+        shutil.copyfile(filename, tmp_filename)
+    try:
+        with h5py.File(tmp_filename, 'r+' if append else 'w') as f:
+            write_streams(f, recordings, append, samples_per_chunk)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+    return recordings.num_samples
+
+
+def write_streams(f, recordings, append, samples_per_chunk):
+    """Writes the streams of a RecordingSet to the open HDF5 file f; see write_session."""
+
+    header = recordings.header
+    if append:
+        if f.attrs['session_version'] != SESSION_VERSION:
+            raise Exception('{} was written by a different version of write_session'.format(f.filename))
+        if f.attrs['num_amplifier_channels'] != header['num_amplifier_channels'] or f.attrs['sample_rate'] != recordings.sample_rate:
+            raise Exception('{} does not match the recordings appended to {}'.format(recordings.filenames[0], f.filename))
+        previous = int(f.attrs['num_samples'])
+        file_starts = np.concatenate((f['file_starts'][:-1], previous + recordings.file_starts))
+        filenames = list(f.attrs['filenames']) + [os.path.basename(name) for name in recordings.filenames]
+        del f['file_starts']
+    else:
+        previous = 0
+        file_starts = recordings.file_starts
+        filenames = [os.path.basename(name) for name in recordings.filenames]
+        f.attrs['session_version'] = SESSION_VERSION
+        f.attrs['sample_rate'] = recordings.sample_rate
+        f.attrs['num_amplifier_channels'] = header['num_amplifier_channels']
+
+    # (view, dataset, decimation, per-file rows of the channels in the dataset or None)
+    datasets = []
+    for stream, (view_name, decimation) in SESSION_STREAMS.items():
+        num_samples = recordings.num_samples // decimation
+        rows = None
+        if stream in CHANNEL_STREAMS:
+            rows = add_channels(f, stream, recordings, append)
+        if append:
+            dset = f[stream]
+            if dset.ndim == 1:
+                dset.resize(dset.shape[0] + num_samples, axis=0)
+            else:
+                dset.resize((len(f['channels_present'][stream].attrs['channel_names']), dset.shape[1] + num_samples))
+        elif stream in ('board_dig_in', 'board_dig_out') or rows is None:
+            dset = f.create_dataset(stream, shape=(num_samples,), maxshape=(None,), dtype=getattr(recordings.recordings[0], view_name)[0:0].dtype,
+                                    chunks=(samples_per_chunk,), compression='lzf', shuffle=True)
+        else:
+            num_channels = len(f['channels_present'][stream].attrs['channel_names'])
+            dset = f.create_dataset(stream, shape=(num_channels, num_samples), maxshape=(None, None), dtype=np.uint16, fillvalue=0,
+                                    chunks=(max(num_channels, 1), samples_per_chunk // decimation), compression='lzf', shuffle=True)
+            dset.attrs['scale'], dset.attrs['offset'] = get_stream_scale(header, stream)
+        if stream in CHANNEL_STREAMS:
+            present = f['channels_present'][stream]
+            dset.attrs['channel_names'] = present.attrs['channel_names']
+            if stream in ('board_dig_in', 'board_dig_out'):
+                dset.attrs['native_order'] = present.attrs['native_order']
+                rows = None
+            elif any(rec.header['num_' + stream + '_channels'] > 0 and get_stream_scale(rec.header, stream) != (dset.attrs['scale'], dset.attrs['offset'])
+                     for rec in recordings.recordings):
+                raise Exception('{} differs in the scale of {} from the files before it in the session'.format(recordings.filenames[0], stream))
+        datasets.append((view_name, dset, decimation, rows))
+
+    # one chunk of every stream at a time, so each part of the RHD files is read once
+    for i, rec in enumerate(recordings.recordings):
+        file_start = previous + int(recordings.file_starts[i])
+        for start in range(0, rec.num_samples, samples_per_chunk):
+            stop = min(start + samples_per_chunk, rec.num_samples)
+            for view_name, dset, decimation, rows in datasets:
+                view = getattr(rec, view_name)
+                lo, hi = start // decimation, stop // decimation
+                offset = file_start // decimation
+                if rows is None:
+                    dset[offset + lo:offset + hi] = view[lo:hi]
+                elif rows[i]:
+                    # h5py writes rows given in increasing order
+                    order = np.argsort(rows[i])
+                    dset[sorted(rows[i]), offset + lo:offset + hi] = view[:, lo:hi][order]
+
+    f.create_dataset('file_starts', data=np.asarray(file_starts, dtype=np.int64))
+    f.attrs['filenames'] = filenames
+    f.attrs['num_samples'] = previous + recordings.num_samples
+
+
+def add_channels(f, stream, recordings, append):
+    """Adds the channels of stream in each file of recordings to 'channels_present/<stream>' of f.
+
+    The channels already in the session keep their rows; new ones are added after them.
+    Returns the rows of the channels of each file, in the order of its header.
+    """
+
+    group = f.require_group('channels_present')
+    if append:
+        old = group[stream]
+        names = list(old.attrs['channel_names'])
+        native_order = list(old.attrs['native_order'])
+        present = old[...]
+        del group[stream]
+    else:
+        names, native_order, present = [], [], np.zeros([0, 0], dtype=bool)
+
+    rows = []
+    for rec in recordings.recordings:
+        file_rows = []
+        for c in rec.header[stream + '_channels']:
+            if c['native_channel_name'] not in names:
+                names.append(c['native_channel_name'])
+                native_order.append(c['native_order'])
+            file_rows.append(names.index(c['native_channel_name']))
+        rows.append(file_rows)
+
+    new = np.zeros([present.shape[0] + len(rows), len(names)], dtype=bool)
+    new[:present.shape[0], :present.shape[1]] = present
+    for i, file_rows in enumerate(rows):
+        new[present.shape[0] + i, file_rows] = True
+    dset = group.create_dataset(stream, data=new)
+    dset.attrs['channel_names'] = names
+    dset.attrs['native_order'] = np.array(native_order, dtype=np.int64)
+    return rows
+
+
+class SessionFile(object):
+    """Reads time ranges of the streams in a file written by write_session, e.g.
+
+        with SessionFile('session.h5') as s:
+            adc = s.read_time('board_adc', 10.0, 20.0, scaled=True)    # seconds 10-20, in volts
+            trigger = s.digital_lines('board_dig_in', 0, 20000)[0]     # first second of digital input 0
+
+    Only the chunks of the requested stream overlapping the range are read.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r')
+        if self.file.attrs['session_version'] != SESSION_VERSION:
+            raise Exception('{} was written by a different version of write_session'.format(filename))
+        self.sample_rate = float(self.file.attrs['sample_rate'])
+        self.num_samples = int(self.file.attrs['num_samples'])
+        self.filenames = list(self.file.attrs['filenames'])
+        self.file_starts = self.file['file_starts'][:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return 'SessionFile({!r}, {} files, {} samples)'.format(self.filename, len(self.filenames), self.num_samples)
+
+    def read(self, stream, start=0, stop=None, channels=slice(None), scaled=False):
+        """Returns samples start to stop (in the stream's own sample rate) of stream.
+
+        Channel streams are returned as [channels, samples], uint16 or, with scaled,
+        float32 volts; timestamps and digital words as [samples].
+        """
+
+        if stream not in SESSION_STREAMS:
+            raise ValueError('stream must be one of {}, not {!r}'.format(sorted(SESSION_STREAMS), stream))
+        dset = self.file[stream]
+        if dset.ndim == 1:
+            return dset[start:stop]
+        if isinstance(channels, (int, np.integer)):
+            x = dset[channels, start:stop]
+        else:
+            x = dset[:, start:stop][channels]
+        if scaled:
+            x = (x.astype(np.float32) - np.float32(dset.attrs['offset'])) * np.float32(dset.attrs['scale'])
+        return x
+
+    def read_time(self, stream, t_start, t_stop, channels=slice(None), scaled=False):
+        """Returns the samples of stream from t_start up to t_stop, in seconds from the start of the session."""
+
+        rate = self.get_sample_rate(stream)
+        return self.read(stream, int(np.ceil(t_start * rate)), int(np.ceil(t_stop * rate)), channels, scaled)
+
+    def get_sample_rate(self, stream):
+        """Returns the sample rate of stream in Hz."""
+
+        return self.sample_rate / SESSION_STREAMS[stream][1]
+
+    def digital_lines(self, stream, start=0, stop=None):
+        """Returns the lines of digital stream 'board_dig_in' or 'board_dig_out' from start to stop as DigitalLines."""
+
+        channels = [{'native_order': int(n)} for n in self.file[stream].attrs['native_order']]
+        return DigitalLines(self.read(stream, start, stop), channels)
+
+    def get_channels_present(self, stream):
+        """Returns (channel names, [files, channels] bool array) telling which channels of stream each RHD file has."""
+
+        present = self.file['channels_present'][stream]
+        return list(present.attrs['channel_names']), present[...]
+
+    def get_file_range(self, index):
+        """Returns (start, stop) amplifier samples of the index-th RHD file of the session."""
+
+        return int(self.file_starts[index]), int(self.file_starts[index + 1])
@@ -0,0 +1,76 @@
+#! /bin/env python
+#
+# Lazy sample times of RHD2000 streams.
+
+import numpy as np
+
+
+class TimeAxis(object):
+    """Sample times (in seconds) of a stream, computed on demand instead of stored.
+
+    The timestamps of a recording are first_timestamp + sample index, except that each
+    gap (a (sample, expected, actual) row from find_timestamp_gaps) shifts every later
+    timestamp by actual - expected.  A stream sampled every decimation amplifier samples
+    (4 for aux inputs, one per data block for supply voltage and temperature) has times
+    t[i] = timestamp(i * decimation) / sample_rate, the same values as the t_* arrays
+    of the readers.  Index or slice it like an array; np.asarray(axis) gives all times.
+    """
+
+    def __init__(self, first_timestamp, sample_rate, num_samples, gaps=None, decimation=1):
+        self.first_timestamp = int(first_timestamp)
+        self.sample_rate = sample_rate
+        self.num_samples = int(num_samples)
+        self.gaps = np.zeros([0, 3], dtype=np.int64) if gaps is None else np.asarray(gaps, dtype=np.int64)
+        self.decimation = int(decimation)
+        # Timestamp shift in effect after each gap.
+        self._shift = np.concatenate(([0], np.cumsum(self.gaps[:, 2] - self.gaps[:, 1])))
+
+    def __repr__(self):
+        return 'TimeAxis({} samples at {} Hz / {}, {} gaps)'.format(len(self), self.sample_rate, self.decimation, len(self.gaps))
+
+    def __len__(self):
+        return -(-self.num_samples // self.decimation)
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    def __array__(self, dtype=None):
+        a = self[:]
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def __getitem__(self, key):
+        return self.timestamps(key) / self.sample_rate
+
+    def timestamps(self, key=slice(None)):
+        """Returns the integer timestamps of the samples selected by key."""
+
+        n = len(self)
+        if key is Ellipsis:
+            key = slice(None)
+        if isinstance(key, slice):
+            samples = np.arange(*key.indices(n), dtype=np.int64)
+        else:
+            key = np.asarray(key)
+            if key.dtype == np.bool_:
+                if key.shape != (n,):
+                    raise IndexError('boolean index must have the length of the time axis')
+                samples = np.flatnonzero(key).astype(np.int64)
+            else:
+                samples = key.astype(np.int64)
+                samples = np.where(samples < 0, samples + n, samples)
+                if np.any((samples < 0) | (samples >= n)):
+                    raise IndexError('index out of range for time axis of length {}'.format(n))
+        samples = samples * self.decimation
+        return self.first_timestamp + samples + self._shift[np.searchsorted(self.gaps[:, 0], samples, side='right')]
+
+    def decimate(self, factor):
+        """Returns the time axis of every factor-th sample of this one."""
+
+        return TimeAxis(self.first_timestamp, self.sample_rate, self.num_samples, self.gaps, self.decimation * factor)
@@ -0,0 +1,97 @@
+"""Runs sorter commands (klusta, mountainsort shells) as subprocesses, several at a time."""
+import os
+import sys
+import time
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_job(name, args, cwd=None, shell=False, timeout=None):
+    """Returns a job for run_job / run_jobs.
+
+    name labels the job in logs, args is the command (a list, or a string when shell is
+    True), cwd the directory it runs in and timeout the seconds after which it is killed
+    (None waits for it to finish).
+    """
+    return {'name': name, 'args': args, 'cwd': cwd, 'shell': shell, 'timeout': timeout}
+
+
+def run_job(job, timeout=None):
+    """Runs one job and waits for it, capturing its output.
+
+    timeout applies when the job does not set its own.  A job that runs out of time is
+    killed together with any processes it started.
+
+    Returns a dictionary with the job's 'name', 'args' and 'cwd', its 'status' ('ok',
+    'failed' for a nonzero exit code, 'timeout', or 'error' if it could not be started),
+    'returncode', 'runtime' in seconds and the 'stdout' and 'stderr' text.
+    """
+    if job.get('timeout') is not None:
+        timeout = job['timeout']
+    result = {'name': job['name'], 'args': job['args'], 'cwd': job.get('cwd'), 'returncode': None, 'stdout': '', 'stderr': ''}
+
+    tic = time.time()
+    try:
+        p = subprocess.Popen(job['args'], cwd=job.get('cwd'), shell=job.get('shell', False), stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True, **new_process_group())
+    except OSError as e:
+        result.update(status='error', runtime=time.time() - tic, stderr=str(e))
+        return result
+
+    try:
+        stdout, stderr = p.communicate(timeout=timeout)
+        status = 'ok' if p.returncode == 0 else 'failed'
+    except subprocess.TimeoutExpired:
+        kill_process_group(p)
+        stdout, stderr = p.communicate()
+        status = 'timeout'
+    result.update(status=status, returncode=p.returncode, runtime=time.time() - tic, stdout=stdout, stderr=stderr)
+    return result
+
+
+def run_jobs(jobs, max_workers=None, timeout=None, log_file=None):
+    """Runs jobs as subprocesses, at most max_workers at once.
+
+    max_workers None runs one job per CPU; timeout is the default per-job timeout, see
+    run_job.  A line with the status and runtime of every job is printed as it finishes
+    and, if log_file is given, appended to it.
+
+    Returns the results of run_job in the same order as jobs.
+    """
+    jobs = list(jobs)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(jobs)))
+
+    def run(job):
+        result = run_job(job, timeout)
+        line = '{0}: {1} (exit code {2}) in {3:0.1f} seconds'.format(result['name'], result['status'], result['returncode'], result['runtime'])
+        print(line)
+        if log_file is not None:
+            with open(log_file, 'a') as f:
+                f.write(line + '\n')
+        return result
+
+    # the jobs run in their own processes, so threads are enough to wait on them
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, jobs))
+
+
+def new_process_group():
+    """Returns the Popen arguments that start a process in a process group of its own."""
+    if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def kill_process_group(p):
+    """Kills process p and the processes it started (e.g. the programs run by a .bat or shell file)."""
+    try:
+        if sys.platform == 'win32':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(p.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    p.kill()
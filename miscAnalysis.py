@@ -1244,6 +1244,7 @@ def extractLFPs(rhdFile,filterFreq=250,sampleRate=20000,downSample=10,stimChanne
 
     from scipy.signal import butter, lfilter, filtfilt, periodogram
     import read_rhd_controller
+    from intanutil.digital_events import get_digital_events
     def butter_lowpass(cutoffs, fs, order=8):
         nyq = 0.5 * fs
         normal_cutoffs = cutoffs / nyq
@@ -1266,8 +1267,8 @@ def extractLFPs(rhdFile,filterFreq=250,sampleRate=20000,downSample=10,stimChanne
 
     except KeyError:
         stim = [0]
-    digIn0 = rhdContents['board_dig_in_data'][0,:]
-    sweepOnsets = np.where(digIn0[1:] > digIn0[:-1])[0]/downSample
+    ## onsets come from the cached event index; it counts the first high sample, np.where(x[1:] > x[:-1]) the one before
+    sweepOnsets = (get_digital_events(rhdFile)['board_dig_in']['onsets'][0] - 1)/downSample
     meanPower500_5000 = []
     for channel in rhdContents['amplifier_data']:
         f, Pxx_den = periodogram(channel, sampleRate)
@@ -1,37 +1,81 @@
 import glob
 import re
+import json
 import numpy as np
-import sys
 import os
 
+MANIFEST_NAME = 'conversion_manifest.json' # written by conversion_manifest.py next to the rhd files
+DEFAULT_DTYPES = {'.di': np.dtype(np.uint), '.ai': np.dtype(np.float64)} # what convert_rhd writes on this platform
+
 def load_intan_input_channels(matchString='*'):
 	#usage:  [di,ai] = load_intan_input_channels() with ai/di files in the path
-	#save digital inputs
-	p = re.compile('chan(\d+).di')  #extract digital input channel ids
-	channel_ids = set(p.findall(' '.join(sorted(glob.glob(matchString+'.di')))))
-	#load in each channel and concatenate.
+	#each channel is read into one array sized up front from the file sizes
 	digital_inputs = {}
-	for ch in channel_ids:
-		files = glob.glob(matchString+'chan' + ch + '.di')
-		files.sort(key=os.path.getmtime)  ## sorting based on modification time
-		for f in files:
-			print(f)
-			if ch in digital_inputs: #concatenation used to rely on alphabetical ordering corresponding to temporal order
-				digital_inputs[ch] = np.append(digital_inputs[ch],(np.fromfile(f, dtype=np.uint32)))
-			else:  #load first array
-				digital_inputs[ch] = np.fromfile(f, dtype=np.uint32)
-	#save analog inputs
-	p = re.compile('chan(\d+).ai')  #extract analog input channel ids
-	channel_ids = set(p.findall(' '.join(sorted(glob.glob(matchString+'.ai')))))
-	#load in each channel and concatenate.
+	for ch, files in find_input_files(matchString, '.di').items():
+		digital_inputs[ch] = read_input_files(files, np.empty(get_num_samples(files), dtype=files[0][1]))
 	analog_inputs = {}
-	for ch in channel_ids:
-		files = glob.glob(matchString+'chan' + ch + '.ai')
-		files.sort(key=os.path.getmtime)
-		for f in files:
-			print(f)
-			if ch in analog_inputs: #load first array
-				analog_inputs[ch] = np.append(analog_inputs[ch],(np.fromfile(f, dtype=np.float64)))  
-			else:  #concatenation relies on alphabetical ordering corresponding to temporal order
-				analog_inputs[ch] = np.fromfile(f, dtype=np.float64)
-	return digital_inputs, analog_inputs
\ No newline at end of file
+	for ch, files in find_input_files(matchString, '.ai').items():
+		analog_inputs[ch] = read_input_files(files, np.empty(get_num_samples(files), dtype=files[0][1]))
+	return digital_inputs, analog_inputs
+
+def find_input_files(matchString, extension):
+	"""Returns {channel id: [(file, dtype), ...]} for the files matchString + 'chan<id>' + extension,
+	each list sorted by modification time (which is the temporal order of the recordings).
+	The dtype of each file comes from the conversion manifest in its folder, or DEFAULT_DTYPES if it has none.
+	"""
+	p = re.compile(r'chan(\d+)'+re.escape(extension)+'$')  #extract input channel ids
+	channels = {}
+	for f in glob.glob(matchString+extension):
+		m = p.search(f)
+		if m:
+			channels.setdefault(m.group(1), []).append(f)
+	manifests = {}
+	inputFiles = {}
+	for ch, files in channels.items():
+		files.sort(key=os.path.getmtime)  ## sorting based on modification time
+		dtypes = [get_input_dtype(f, extension, manifests) for f in files]
+		if len(set(dtypes)) > 1:
+			raise Exception('channel %s files were written with different dtypes: %s' % (ch, sorted(set(d.str for d in dtypes))))
+		inputFiles[ch] = list(zip(files, dtypes))
+	return inputFiles
+
+def get_input_dtype(f, extension, manifests):
+	"""Returns the dtype of .di/.ai file f recorded in the conversion manifest of its folder.
+	manifests caches the manifests already read, by folder.
+	"""
+	folder = os.path.dirname(os.path.abspath(f))
+	if folder not in manifests:
+		manifests[folder] = {}
+		try:
+			with open(os.path.join(folder, MANIFEST_NAME), 'r') as m:
+				for entry in json.load(m)['files'].values():
+					meta = entry['meta']
+					for name in meta['di_files']:
+						if 'di_dtype' in meta: manifests[folder][name] = np.dtype(meta['di_dtype'])
+					for name in meta['ai_files']:
+						if 'ai_dtype' in meta: manifests[folder][name] = np.dtype(meta['ai_dtype'])
+		except (IOError, OSError, ValueError, KeyError):
+			pass
+	return manifests[folder].get(os.path.basename(f), DEFAULT_DTYPES[extension])
+
+def get_num_samples(files):
+	"""Returns the total number of samples in a list of (file, dtype)."""
+	total = 0
+	for f, dtype in files:
+		size = os.path.getsize(f)
+		if size % dtype.itemsize != 0:
+			raise Exception('%s does not hold a whole number of %s samples' % (f, dtype))
+		total += size // dtype.itemsize
+	return total
+
+def read_input_files(files, out):
+	"""Reads a list of (file, dtype) one after another into out (an array or np.memmap of the total length) and returns it."""
+	pos = 0
+	for f, dtype in files:
+		print(f)
+		n = os.path.getsize(f) // dtype.itemsize
+		with open(f, 'rb') as fid:
+			if fid.readinto(out[pos:pos+n]) != n * dtype.itemsize:
+				raise Exception('%s was shorter than expected' % f)
+		pos += n
+	return out
@@ -1,48 +1,67 @@
-import glob
-import re
+import json
 import numpy as np
-import sys
 import os
+from load_intan_input_channels import find_input_files, get_num_samples, read_input_files
+
+RECORD_NAME = 'input_channels.json' # metadata record of the memory-mapped channel files in savePath
 
 def load_intan_input_channels(matchString='*', savePath = None):
     """
     usage:  [di,ai] = load_intan_input_channels() with ai/di files in the path
-    save digital inputs
-    savePath is the path where the file will be stored for memmap and future reference
+    Each channel is copied once into its own file in savePath (digital_input_<ch>.bin, analog_input_<ch>.bin),
+    sized up front from the input files, and returned as a read-only np.memmap of it.
+    savePath is the path where the files will be stored for memmap and future reference;
+    a later call with the same, unchanged input files maps them again without copying anything.
     """
     if savePath == None:
         savePath = os.getcwd()
-    p = re.compile('chan(\d+).di')  #extract digital input channel ids
-    channel_ids = set(p.findall(' '.join(sorted(glob.glob(matchString+'.di')))))
-    #load in each channel and concatenate.
+    record = load_record(savePath)
+
     digital_inputs = {}
-    for ch in channel_ids:
-        files = glob.glob(matchString+'chan' + ch + '.di')
-        files.sort(key=os.path.getmtime)  ## sorting based on modification time
-        for f in files:
-            print(f)
-            if ch in digital_inputs: #concatenation used to rely on alphabetical ordering corresponding to temporal order
-                digital_inputs[ch] = np.append(digital_inputs[ch],(np.fromfile(f, dtype=np.uint32)))
-            else:  #load first array
-                digital_inputs[ch] = np.fromfile(f, dtype=np.uint32)
-    #save analog inputs
-    p = re.compile('chan(\d+).ai')  #extract analog input channel ids
-    channel_ids = set(p.findall(' '.join(sorted(glob.glob(matchString+'.ai')))))
-    #load in each channel and concatenate.
+    for ch, files in find_input_files(matchString, '.di').items():
+        digital_inputs[ch] = map_channel(files, os.path.join(savePath, 'digital_input_%s.bin' % ch), record)
     analog_inputs = {}
-    for ch in channel_ids:
-        files = glob.glob(matchString+'chan' + ch + '.ai')
-        files.sort(key=os.path.getmtime)
-        for f in files:
-            print(f)
-            if ch in analog_inputs: #load first array
-                analog_inputs[ch] = np.append(analog_inputs[ch],(np.fromfile(f, dtype=np.float64)))  
-            else:  #concatenation relies on alphabetical ordering corresponding to temporal order
-                analog_inputs[ch] = np.fromfile(f, dtype=np.float64)
-    np.save(os.path.join(savePath,'digital_inputs.npy'), digital_inputs)
-    np.save(os.path.join(savePath,'analog_inputs.npy'), analog_inputs)
-    
-    di = np.load(savePath+'\\digital_inputs.npy',mmap_mode='r')
-    ai = np.load(savePath+'\\analog_inputs.npy',mmap_mode='r')
-    
-    return di, ai
\ No newline at end of file
+    for ch, files in find_input_files(matchString, '.ai').items():
+        analog_inputs[ch] = map_channel(files, os.path.join(savePath, 'analog_input_%s.bin' % ch), record)
+
+    save_record(savePath, record)
+    return digital_inputs, analog_inputs
+
+def map_channel(files, channelFile, record):
+    """
+    Returns a read-only np.memmap of channelFile holding the concatenated (file, dtype) list files,
+    writing it first unless record shows it was made from the same files.
+    """
+    name = os.path.basename(channelFile)
+    dtype = files[0][1]
+    sources = [[os.path.abspath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f, fileDtype in files]
+    numSamples = get_num_samples(files)
+    entry = {'dtype': dtype.str, 'shape': [numSamples], 'sources': sources}
+
+    if numSamples == 0:
+        record[name] = entry
+        return np.zeros(0, dtype=dtype)
+    if record.get(name) != entry or not os.path.isfile(channelFile) or os.path.getsize(channelFile) != numSamples * dtype.itemsize:
+        record.pop(name, None)
+        out = np.memmap(channelFile, dtype=dtype, mode='w+', shape=(numSamples,))
+        read_input_files(files, out)
+        out.flush()
+        del out
+        record[name] = entry
+    # dtype and shape come from the metadata record
+    return np.memmap(channelFile, dtype=np.dtype(record[name]['dtype']), mode='r', shape=tuple(record[name]['shape']))
+
+def load_record(savePath):
+    """Returns the metadata record of the channel files in savePath, or an empty one."""
+    try:
+        with open(os.path.join(savePath, RECORD_NAME), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save_record(savePath, record):
+    """Writes the metadata record of the channel files in savePath."""
+    tmpFile = os.path.join(savePath, RECORD_NAME + '.tmp')
+    with open(tmpFile, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmpFile, os.path.join(savePath, RECORD_NAME))
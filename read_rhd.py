@@ -1,167 +1,56 @@
 #modified from scipy v0.19 by @peltonen
 import numpy as np
-import sys, struct, math, os, time
+import math, os, time
+from concurrent.futures import ThreadPoolExecutor
 import scipy.signal as signal
 
-def read_rhd(filename):
+from intanutil.load_data import load_data
+
+def read_rhd(filename, channels=None, streams=None, dig_lines=None, dtype=None, notch_workers=None):
     #Reads Intan Technologies RHD2000 data file generated by evaluation board GUI. Then generates corresponding 
     #uint16 .dat and appropriate prm files 
+    #channels, streams and dig_lines restrict decoding to some amplifier channels, streams and digital
+    #input lines; see read_rhd_controller.read_data
+    #dtype None keeps uint16 amplifier data and float64 scaled aux, supply, ADC and temperature data;
+    #'raw', 'int16' or 'float32' select a compact output policy (see intanutil.convert_data.convert_data),
+    #with the digital lines as DigitalLines accessors over the raw uint16 words and the t_* times
+    #as lazy intanutil.time_axis.TimeAxis objects
+    #notch_workers is the number of threads used for the notch filter, default one per CPU (see notch_filter_channels)
 
     tic = time.time()
-    fid = open(filename, 'rb')
-    filesize = os.path.getsize(filename)
-
-    header = read_header(fid)
-
-    print('Found {} amplifier channel{}.'.format(header['num_amplifier_channels'], plural(header['num_amplifier_channels'])))
-    print('Found {} auxiliary input channel{}.'.format(header['num_aux_input_channels'], plural(header['num_aux_input_channels'])))
-    print('Found {} supply voltage channel{}.'.format(header['num_supply_voltage_channels'], plural(header['num_supply_voltage_channels'])))
-    print('Found {} board ADC channel{}.'.format(header['num_board_adc_channels'], plural(header['num_board_adc_channels'])))
-    print('Found {} board digital input channel{}.'.format(header['num_board_dig_in_channels'], plural(header['num_board_dig_in_channels'])))
-    print('Found {} board digital output channel{}.'.format(header['num_board_dig_out_channels'], plural(header['num_board_dig_out_channels'])))
-    print('Found {} temperature sensors channel{}.'.format(header['num_temp_sensor_channels'], plural(header['num_temp_sensor_channels'])))
-    print('')
-
-    # Determine how many samples the data file contains.
-    bytes_per_block = get_bytes_per_data_block(header)
-
-    # How many data blocks remain in this file?
-    data_present = False
-    bytes_remaining = filesize - fid.tell()
-    if bytes_remaining > 0:
-        data_present = True
-
-    if bytes_remaining % bytes_per_block != 0:
-        raise Exception('Something is wrong with file size : should have a whole number of data blocks')
-
-    num_data_blocks = int(bytes_remaining / bytes_per_block)
-
-    num_amplifier_samples = 60 * num_data_blocks
-    num_aux_input_samples = 15 * num_data_blocks
-    num_supply_voltage_samples = 1 * num_data_blocks
-    num_board_adc_samples = 60 * num_data_blocks
-    num_board_dig_in_samples = 60 * num_data_blocks
-    num_board_dig_out_samples = 60 * num_data_blocks
-
-    record_time = num_amplifier_samples / header['sample_rate']
-
-    if data_present:
-        print('File contains {:0.3f} seconds of data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(record_time, header['sample_rate'] / 1000))
-    else:
-        print('Header file contains no data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(header['sample_rate'] / 1000))
-
-    if data_present:
-        # Pre-allocate memory for data.
-        print('')
-        print('Allocating memory for data...')
-
-        data = {}
-        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.int)
-        else:
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.uint)
-
-        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint16)
-        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], num_aux_input_samples], dtype=np.uint)
-        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-        data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-        data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
-        data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.uint)
-        data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
-
-        # Read sampled data from file.
-        print('Reading data from file...')
-
-        # Initialize indices used in looping
-        indices = {}
-        indices['amplifier'] = 0
-        indices['aux_input'] = 0
-        indices['supply_voltage'] = 0
-        indices['board_adc'] = 0
-        indices['board_dig_in'] = 0
-        indices['board_dig_out'] = 0
-
-        print_increment = 10
-        percent_done = print_increment
-        for i in range(num_data_blocks):
-            read_one_data_block(data, header, indices, fid)
-
-            # Increment indices
-            indices['amplifier'] += 60
-            indices['aux_input'] += 15
-            indices['supply_voltage'] += 1
-            indices['board_adc'] += 60
-            indices['board_dig_in'] += 60
-            indices['board_dig_out'] += 60      
-
-            fraction_done = 100 * (1.0 * i / num_data_blocks)
-            if fraction_done >= percent_done:
-                print('{}% done...'.format(percent_done))
-                percent_done = percent_done + print_increment
-
-        # Make sure we have read exactly the right amount of data.
-        bytes_remaining = filesize - fid.tell()
-        if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
-
-
-
-    # Close data file.
-    fid.close()
+    header, data, data_present = load_data(filename, channels, streams, dig_lines, dtype)
 
     if (data_present):
-        print('Parsing data...')
-
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
-
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
-
-        # Scale voltage levels appropriately.
-        data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
-        data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
-        if header['eval_board_mode'] == 1:
-            data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts    
-        else:
-            data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
-        data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
-
-        # Check for gaps in timestamps.
-        num_gaps = np.sum(np.not_equal(data['t_amplifier'][1:]-data['t_amplifier'][:-1], 1))
-        if num_gaps == 0:
-            print('No missing timestamps in data.')
-        else:
-            print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
-
-        # Scale time steps (units = seconds).
-        data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
-        data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
-        data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 60)]
-        data['t_board_adc'] = data['t_amplifier']
-        data['t_dig'] = data['t_amplifier']
-        data['t_temp_sensor'] = data['t_supply_voltage']
-        
+        if dtype is None:
+            num_board_dig_in_samples = len(data['board_dig_in_raw'])
+            num_board_dig_out_samples = len(data['board_dig_out_raw'])
+
+            data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
+            data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.uint)
+
+            # Extract digital input channels to separate variables.
+            for i in range(header['num_board_dig_in_channels']):
+                data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
+
+            # Extract digital output channels to separate variables.
+            for i in range(header['num_board_dig_out_channels']):
+                data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
+
+            # Scale voltage levels appropriately.
+            data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
+            data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
+            if header['eval_board_mode'] == 1:
+                data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts    
+            else:
+                data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
+            data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
+
         # If the software notch filter was selected during the recording, apply the
-        # same notch filter to amplifier data here.
-        if header['notch_filter_frequency'] > 0:
-            b, a = design_notch_filter((header['notch_filter_frequency']/(header['sample_rate'] / 2.0)), 10)  
+        # same notch filter to amplifier data here, rounding back into its dtype.
+        if header['notch_filter_frequency'] > 0 and header['num_amplifier_channels'] > 0:
             print('Applying notch filter...')
-
-            print_increment = 10
-            percent_done = print_increment
-            for i in range(header['num_amplifier_channels']):
-                data['amplifier_data'][i,:] = signal.filtfilt(b, a, data['amplifier_data'][i,:], padlen=150)
-                fraction_done = 100 * (i / header['num_amplifier_channels'])
-                if fraction_done >= percent_done:
-                    print('{}% done...'.format(percent_done))
-                    percent_done += print_increment
-
-    else:
-        data = [];
+            notch_filter_channels(data['amplifier_data'], header['sample_rate'], header['notch_filter_frequency'],
+                                  out=data['amplifier_data'], num_workers=notch_workers)
 
     # Move variables to result struct.
     result = data_to_result(header, data, data_present)
@@ -180,238 +69,14 @@ def read_rhd(filename):
 
 
 
-def plural(n):
-    """Utility function to optionally pluralize words based on the value of n.
-    """
-
-    if n == 1:
-        return ''
-    else:
-        return 's'
-        
-def read_header(fid):
-    """Reads the Intan File Format header from the given file."""
-
-    # Check 'magic number' at beginning of file to make sure this is an Intan
-    # Technologies RHD2000 data file.
-    magic_number, = struct.unpack('<I', fid.read(4)) 
-    if magic_number != int('c6912702', 16): raise Exception('Unrecognized file type.')
-
-    header = {}
-    # Read version number.
-    version = {}
-    (version['major'], version['minor']) = struct.unpack('<hh', fid.read(4)) 
-    header['version'] = version
-
-    print('')
-    print('Reading Intan Technologies RHD2000 Data File, Version {}.{}'.format(version['major'], version['minor']))
-    print('')
-
-    freq = {}
-
-    # Read information of sampling rate and amplifier frequency settings.
-    header['sample_rate'], = struct.unpack('<f', fid.read(4))
-    (freq['dsp_enabled'], freq['actual_dsp_cutoff_frequency'], freq['actual_lower_bandwidth'], freq['actual_upper_bandwidth'], 
-    freq['desired_dsp_cutoff_frequency'], freq['desired_lower_bandwidth'], freq['desired_upper_bandwidth']) = struct.unpack('<hffffff', fid.read(26))
-
-
-    # This tells us if a software 50/60 Hz notch filter was enabled during
-    # the data acquisition.
-    notch_filter_mode, = struct.unpack('<h', fid.read(2))
-    header['notch_filter_frequency'] = 0
-    if notch_filter_mode == 1:
-        header['notch_filter_frequency'] = 50
-    elif notch_filter_mode == 2:
-        header['notch_filter_frequency'] = 60
-    freq['notch_filter_frequency'] = header['notch_filter_frequency']
-
-    (freq['desired_impedance_test_frequency'], freq['actual_impedance_test_frequency']) = struct.unpack('<ff', fid.read(8))
-
-    note1 = read_qstring(fid)
-    note2 = read_qstring(fid)
-    note3 = read_qstring(fid)
-    header['notes'] = { 'note1' : note1, 'note2' : note2, 'note3' : note3}
-
-    # If data file is from GUI v1.1 or later, see if temperature sensor data was saved.
-    header['num_temp_sensor_channels'] = 0
-    if (version['major'] == 1 and version['minor'] >= 1) or (version['major'] > 1) :
-        header['num_temp_sensor_channels'], = struct.unpack('<h', fid.read(2))
-
-
-    # If data file is from GUI v1.3 or later, load eval board mode.
-    header['eval_board_mode'] = 0
-    if ((version['major'] == 1) and (version['minor'] >= 3)) or (version['major'] > 1) :
-        header['eval_board_mode'], = struct.unpack('<h', fid.read(2))
-
-    # Place frequency-related information in data structure. (Note: much of this structure is set above)
-    freq['amplifier_sample_rate'] = header['sample_rate']
-    freq['aux_input_sample_rate'] = header['sample_rate'] / 4
-    freq['supply_voltage_sample_rate'] = header['sample_rate'] / 60
-    freq['board_adc_sample_rate'] = header['sample_rate']
-    freq['board_dig_in_sample_rate'] = header['sample_rate']
-
-    header['frequency_parameters'] = freq
-
-    # Create structure arrays for each type of data channel.
-    header['spike_triggers'] = []
-    header['amplifier_channels'] = []
-    header['aux_input_channels'] = []
-    header['supply_voltage_channels'] = []
-    header['board_adc_channels'] = []
-    header['board_dig_in_channels'] = []
-    header['board_dig_out_channels'] = []
-
-    # Read signal summary from data file header.
-
-    number_of_signal_groups, = struct.unpack('<h', fid.read(2))
-
-    for signal_group in range(0, number_of_signal_groups):
-        signal_group_name = read_qstring(fid)
-        signal_group_prefix = read_qstring(fid)
-        (signal_group_enabled, signal_group_num_channels, signal_group_num_amp_channels) = struct.unpack('<hhh', fid.read(6))
-
-        if (signal_group_num_channels > 0) and (signal_group_enabled > 0):
-            for signal_channel in range(0, signal_group_num_channels):
-                new_channel = {'port_name' : signal_group_name, 'port_prefix' : signal_group_prefix, 'port_number' : signal_group}
-                new_channel['native_channel_name'] = read_qstring(fid)
-                new_channel['custom_channel_name'] = read_qstring(fid)
-                (new_channel['native_order'], new_channel['custom_order'], signal_type, channel_enabled, new_channel['chip_channel'], new_channel['board_stream']) = struct.unpack('<hhhhhh', fid.read(12))
-                new_trigger_channel = {}
-                (new_trigger_channel['voltage_trigger_mode'], new_trigger_channel['voltage_threshold'], new_trigger_channel['digital_trigger_channel'], new_trigger_channel['digital_edge_polarity'])  = struct.unpack('<hhhh', fid.read(8))
-                (new_channel['electrode_impedance_magnitude'], new_channel['electrode_impedance_phase']) = struct.unpack('<ff', fid.read(8))
-
-                if channel_enabled:
-                    if signal_type == 0:
-                        header['amplifier_channels'].append(new_channel)
-                        header['spike_triggers'].append(new_trigger_channel)
-                    elif signal_type == 1:
-                        header['aux_input_channels'].append(new_channel)
-                    elif signal_type == 2:
-                        header['supply_voltage_channels'].append(new_channel)
-                    elif signal_type == 3:
-                        header['board_adc_channels'].append(new_channel)
-                    elif signal_type == 4:
-                        header['board_dig_in_channels'].append(new_channel)
-                    elif signal_type == 5:
-                        header['board_dig_out_channels'].append(new_channel)
-                    else:
-                        raise Exception('Unknown channel type.')
-
-
-    # Summarize contents of data file.
-    header['num_amplifier_channels'] = len(header['amplifier_channels'])
-    header['num_aux_input_channels'] = len(header['aux_input_channels'])
-    header['num_supply_voltage_channels'] = len(header['supply_voltage_channels'])
-    header['num_board_adc_channels'] = len(header['board_adc_channels'])
-    header['num_board_dig_in_channels'] = len(header['board_dig_in_channels'])
-    header['num_board_dig_out_channels'] = len(header['board_dig_out_channels'])
-
-    return header
-
-def read_one_data_block(data, header, indices, fid):
-    """Reads one 60-sample data block from fid into data, at the location indicated by indices."""
-
-    # In version 1.2, we moved from saving timestamps as unsigned
-    # integers to signed integers to accommodate negative (adjusted)
-    # timestamps for pretrigger data['
-    if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-        data['t_amplifier'][indices['amplifier']:(indices['amplifier']+60)] = np.array(struct.unpack('<' + 'i' *60, fid.read(240)))
-    else:
-        data['t_amplifier'][indices['amplifier']:(indices['amplifier']+60)] = np.array(struct.unpack('<' + 'I' *60, fid.read(240)))
-
-    if header['num_amplifier_channels'] > 0:
-        tmp = np.fromfile(fid, dtype='uint16', count=60 * header['num_amplifier_channels'])
-        data['amplifier_data'][range(header['num_amplifier_channels']), indices['amplifier']:(indices['amplifier']+60)] = tmp.reshape(header['num_amplifier_channels'], 60)
-
-    if header['num_aux_input_channels'] > 0:
-        tmp = np.fromfile(fid, dtype='uint16', count=15 * header['num_aux_input_channels'])
-        data['aux_input_data'][range(header['num_aux_input_channels']), indices['aux_input']:(indices['aux_input']+15)] = tmp.reshape(header['num_aux_input_channels'], 15)
-
-    if header['num_supply_voltage_channels'] > 0:
-        tmp = np.fromfile(fid, dtype='uint16', count=1 * header['num_supply_voltage_channels'])
-        data['supply_voltage_data'][range(header['num_supply_voltage_channels']), indices['supply_voltage']:(indices['supply_voltage']+1)] = tmp.reshape(header['num_supply_voltage_channels'], 1)
-
-    if header['num_temp_sensor_channels'] > 0:
-        tmp = np.fromfile(fid, dtype='uint16', count=1 * header['num_temp_sensor_channels'])
-        data['temp_sensor_data'][range(header['num_temp_sensor_channels']), indices['supply_voltage']:(indices['supply_voltage']+1)] = tmp.reshape(header['num_temp_sensor_channels'], 1)
-
-    if header['num_board_adc_channels'] > 0:
-        tmp = np.fromfile(fid, dtype='uint16', count=60 * header['num_board_adc_channels'])
-        data['board_adc_data'][range(header['num_board_adc_channels']), indices['board_adc']:(indices['board_adc']+60)] = tmp.reshape(header['num_board_adc_channels'], 60)
-
-    if header['num_board_dig_in_channels'] > 0:
-        data['board_dig_in_raw'][indices['board_dig_in']:(indices['board_dig_in']+60)] = np.array(struct.unpack('<' + 'H' *60, fid.read(120)))
-
-    if header['num_board_dig_out_channels'] > 0:
-        data['board_dig_out_raw'][indices['board_dig_out']:(indices['board_dig_out']+60)] = np.array(struct.unpack('<' + 'H' *60, fid.read(120)))
-
-def read_qstring(fid):
-    """Read Qt style QString.  
-
-    The first 32-bit unsigned number indicates the length of the string (in bytes).  
-    If this number equals 0xFFFFFFFF, the string is null.
-
-    Strings are stored as unicode.
-    """
-
-    length, = struct.unpack('<I', fid.read(4))
-    if length == int('ffffffff', 16): return ""
-
-    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1) :
-        print(length)
-        raise Exception('Length too long.')
-
-    # convert length from bytes to 16-bit Unicode words
-    length = int(length / 2)
-
-    data = []
-    for i in range(0, length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-
-    if sys.version_info >= (3,0):
-        a = ''.join([chr(c) for c in data])
-    else:
-        a = ''.join([unichr(c) for c in data])
-    
-    return a
-
-def get_bytes_per_data_block(header):
-    """Calculates the number of bytes in each 60-sample datablock."""
-
-    # Each data block contains 60 amplifier samples.
-    bytes_per_block = 60 * 4  # timestamp data
-    bytes_per_block = bytes_per_block + 60 * 2 * header['num_amplifier_channels']
-
-    # Auxiliary inputs are sampled 4x slower than amplifiers
-    bytes_per_block = bytes_per_block + 15 * 2 * header['num_aux_input_channels']
-
-    # Supply voltage is sampled 60x slower than amplifiers
-    bytes_per_block = bytes_per_block + 1 * 2 * header['num_supply_voltage_channels']
-
-    # Board analog inputs are sampled at same rate as amplifiers
-    bytes_per_block = bytes_per_block + 60 * 2 * header['num_board_adc_channels']
-
-    # Board digital inputs are sampled at same rate as amplifiers
-    if header['num_board_dig_in_channels'] > 0:
-        bytes_per_block = bytes_per_block + 60 * 2
-
-    # Board digital outputs are sampled at same rate as amplifiers
-    if header['num_board_dig_out_channels'] > 0:
-        bytes_per_block = bytes_per_block + 60 * 2
-
-    # Temp sensor is sampled 60x slower than amplifiers
-    if header['num_temp_sensor_channels'] > 0:
-        bytes_per_block = bytes_per_block + 1 * 2 * header['num_temp_sensor_channels']
-
-    return bytes_per_block
-
 def data_to_result(header, data, data_present):
     """Moves the header and data (if present) into a common object."""
 
     result = {}
     result['notes'] = header['notes']
     result['frequency_parameters'] = header['frequency_parameters']
+    if data_present:
+        result['timestamp_gaps'] = data['timestamp_gaps']
 
     if header['num_amplifier_channels'] > 0:
         result['amplifier_channels'] = header['amplifier_channels']
@@ -509,4 +174,96 @@ def design_notch_filter(w0, Q):
     b = gain*np.array([1.0, -2.0*np.cos(w0), 1.0])
     a = np.array([1.0, -2.0*gain*np.cos(w0), (2.0*gain-1.0)])
     
-    return b, a
\ No newline at end of file
+    return b, a
+
+
+# Chunk overlap is chosen so the notch filter's impulse response has decayed to this fraction.
+NOTCH_SETTLE = 1e-7
+
+def notch_filter_channels(x, fs, f_notch, Q=10, out=None, chunk_size=1 << 18, num_workers=None):
+    """Zero-phase notch filters every row (channel) of x, a [channels, samples] array.
+
+    The filter from design_notch_filter is run forwards and backwards in SOS form over all
+    channels at once, chunk_size samples at a time.  Each chunk is read with enough of its
+    neighbours on either side for the filter to settle, so the result matches filtering
+    the whole recording; the ends of the recording are padded as by signal.filtfilt with
+    padlen=150.  The channels are split across num_workers threads (default one per CPU;
+    sosfilt runs without holding the GIL).
+
+    The result is rounded (and clipped) into out when out has an integer dtype, e.g. the
+    uint16 samples or int16 (0.195 uV) data of the readers, or stored as is in a float
+    array.  out may be x itself.  out defaults to a new float32 array, which is returned.
+    """
+
+    if out is None:
+        out = np.zeros(x.shape, dtype=np.float32)
+    num_channels, num_samples = x.shape
+    if num_channels == 0 or num_samples == 0:
+        return out
+
+    b, a = design_notch_filter(f_notch / (fs / 2.0), Q)
+    sos = signal.tf2sos(b, a)
+    zi = signal.sosfilt_zi(sos)[:, np.newaxis, :]
+    radius = np.max(np.abs(np.roots(a)))
+    overlap = int(math.ceil(math.log(NOTCH_SETTLE) / math.log(radius)))
+    padlen = min(150, num_samples - 1)
+
+    if np.issubdtype(out.dtype, np.integer):
+        info = np.iinfo(out.dtype)
+        def store(start, stop, y):
+            np.clip(np.rint(y, out=y), info.min, info.max, out=y)
+            out[:, start:stop] = y
+    else:
+        def store(start, stop, y):
+            out[:, start:stop] = y
+
+    def filtfilt_rows(ext, rows):
+        y, _ = signal.sosfilt(sos, ext[rows], axis=1, zi=zi * ext[rows, 0, np.newaxis])
+        y = y[:, ::-1]
+        y, _ = signal.sosfilt(sos, y, axis=1, zi=zi * y[:, 0, np.newaxis])
+        ext[rows] = y[:, ::-1]
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, num_channels))
+    groups = [slice(rows[0], rows[-1] + 1) for rows in np.array_split(np.arange(num_channels), num_workers)]
+
+    print_increment = 10
+    percent_done = print_increment
+    pool = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        # The unfiltered samples before start, kept from the previous chunk: when out is x
+        # they have already been overwritten there.
+        history = np.empty([num_channels, 0])
+        for start in range(0, num_samples, chunk_size):
+            stop = min(start + chunk_size, num_samples)
+            lo = max(0, start - overlap)
+            hi = min(num_samples, stop + overlap)
+
+            # Interior chunk edges are covered by the overlap; the ends of the recording
+            # get filtfilt's odd extension.
+            left = padlen if lo == 0 else 0
+            right = padlen if hi == num_samples else 0
+            ext = np.empty([num_channels, left + (hi - lo) + right])
+            ext[:, left:left + (start - lo)] = history
+            ext[:, left + (start - lo):left + (hi - lo)] = x[:, start:hi]
+            if left:
+                ext[:, :left] = 2 * ext[:, left:left + 1] - ext[:, 2 * left:left:-1]
+            if right:
+                ext[:, -right:] = 2 * ext[:, -right - 1:-right] - ext[:, -right - 2:-2 * right - 2:-1]
+            history = ext[:, left + max(lo, stop - overlap) - lo:left + stop - lo].copy()
+
+            if pool is None:
+                filtfilt_rows(ext, groups[0])
+            else:
+                list(pool.map(lambda rows: filtfilt_rows(ext, rows), groups))
+            store(start, stop, ext[:, left + start - lo:left + stop - lo])
+
+            fraction_done = 100 * (stop / num_samples)
+            while fraction_done >= percent_done and percent_done < 100:
+                print('{}% done...'.format(percent_done))
+                percent_done += print_increment
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return out
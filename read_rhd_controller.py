@@ -7,166 +7,65 @@
 import sys, struct, math, os, time
 import numpy as np
 
-from intanutil.read_header import read_header
+from intanutil.read_header import read_header, parse_header, HeaderTruncated, HEADER_READ_SIZE
 from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
-from intanutil.read_one_data_block import read_one_data_block
+from intanutil.read_data_blocks import get_data_block_dtype, data_blocks_to_arrays, find_timestamp_gaps
 from intanutil.notch_filter import notch_filter
 from intanutil.data_to_result import data_to_result
+from intanutil.load_data import load_data
 
 
-def read_data(filename):
+def read_data(filename, channels=None, streams=None, dig_lines=None, dtype=None):
     """Reads Intan Technologies RHD2000 data file generated by evaluation board GUI.
     
     Data are returned in a dictionary, for future extensibility.
+
+    channels: indices of the amplifier channels to read (default all).
+    streams: names of the streams to read, any of 'amplifier', 'aux_input', 'supply_voltage',
+        'temp_sensor', 'board_adc', 'board_dig_in', 'board_dig_out' (default all).
+    dig_lines: indices of the board digital input channels to extract (default all).
+    Unrequested streams and channels are skipped while decoding and left out of the result.
+    dtype: None returns float64 data in physical units, as always; 'raw', 'int16' or 'float32'
+        select a compact output policy instead (see intanutil.convert_data.convert_data), in
+        which board_dig_in_data and board_dig_out_data are DigitalLines accessors over the raw
+        uint16 words rather than dense boolean arrays, and the t_* times are lazy
+        intanutil.time_axis.TimeAxis objects rather than float64 arrays.
     """
 
     tic = time.time()
-    fid = open(filename, 'rb')
-    filesize = os.path.getsize(filename)
-
-    header = read_header(fid)
-
-    print('Found {} amplifier channel{}.'.format(header['num_amplifier_channels'], plural(header['num_amplifier_channels'])))
-    print('Found {} auxiliary input channel{}.'.format(header['num_aux_input_channels'], plural(header['num_aux_input_channels'])))
-    print('Found {} supply voltage channel{}.'.format(header['num_supply_voltage_channels'], plural(header['num_supply_voltage_channels'])))
-    print('Found {} board ADC channel{}.'.format(header['num_board_adc_channels'], plural(header['num_board_adc_channels'])))
-    print('Found {} board digital input channel{}.'.format(header['num_board_dig_in_channels'], plural(header['num_board_dig_in_channels'])))
-    print('Found {} board digital output channel{}.'.format(header['num_board_dig_out_channels'], plural(header['num_board_dig_out_channels'])))
-    print('Found {} temperature sensors channel{}.'.format(header['num_temp_sensor_channels'], plural(header['num_temp_sensor_channels'])))
-    print('')
-
-    # Determine how many samples the data file contains.
-    bytes_per_block = get_bytes_per_data_block(header)
-
-    # How many data blocks remain in this file?
-    data_present = False
-    bytes_remaining = filesize - fid.tell()
-    if bytes_remaining > 0:
-        data_present = True
-
-    if bytes_remaining % bytes_per_block != 0:
-        raise Exception('Something is wrong with file size : should have a whole number of data blocks')
-
-    num_data_blocks = int(bytes_remaining / bytes_per_block)
-
-    num_amplifier_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_aux_input_samples = int((header['num_samples_per_data_block'] / 4) * num_data_blocks)
-    num_supply_voltage_samples = 1 * num_data_blocks
-    num_board_adc_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_in_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_out_samples = header['num_samples_per_data_block'] * num_data_blocks
-
-    record_time = num_amplifier_samples / header['sample_rate']
-
-    if data_present:
-        print('File contains {:0.3f} seconds of data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(record_time, header['sample_rate'] / 1000))
-    else:
-        print('Header file contains no data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(header['sample_rate'] / 1000))
-
-    if data_present:
-        # Pre-allocate memory for data.
-        print('')
-        print('Allocating memory for data...')
-
-        data = {}
-        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.int)
-        else:
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.uint)
-
-        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint)
-        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], num_aux_input_samples], dtype=np.uint)
-        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-        
-        # by default, this script interprets digital events (digital inputs and outputs) as booleans
-        # if unsigned int values are preferred(0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
-        # the commented line below illustrates this for digital input data; the same can be done for digital out
-        
-        #data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-        data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.bool)
-        data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
-        
-        data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.bool)
-        data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
-
-        # Read sampled data from file.
-        print('Reading data from file...')
-
-        # Initialize indices used in looping
-        indices = {}
-        indices['amplifier'] = 0
-        indices['aux_input'] = 0
-        indices['supply_voltage'] = 0
-        indices['board_adc'] = 0
-        indices['board_dig_in'] = 0
-        indices['board_dig_out'] = 0
-
-        print_increment = 10
-        percent_done = print_increment
-        for i in range(num_data_blocks):
-            read_one_data_block(data, header, indices, fid)
-
-            # Increment indices
-            indices['amplifier'] += header['num_samples_per_data_block']
-            indices['aux_input'] += int(header['num_samples_per_data_block'] / 4)
-            indices['supply_voltage'] += 1
-            indices['board_adc'] += header['num_samples_per_data_block']
-            indices['board_dig_in'] += header['num_samples_per_data_block']
-            indices['board_dig_out'] += header['num_samples_per_data_block']            
-
-            fraction_done = 100 * (1.0 * i / num_data_blocks)
-            if fraction_done >= percent_done:
-                print('{}% done...'.format(percent_done))
-                percent_done = percent_done + print_increment
-
-        # Make sure we have read exactly the right amount of data.
-        bytes_remaining = filesize - fid.tell()
-        if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
-
-
-
-    # Close data file.
-    fid.close()
+    header, data, data_present = load_data(filename, channels, streams, dig_lines, dtype)
 
     if (data_present):
-        print('Parsing data...')
-
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
-
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
-
-        # Scale voltage levels appropriately.
-        data['amplifier_data'] = np.multiply(0.195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = microvolts
-        data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
-        data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
-        if header['eval_board_mode'] == 1:
-            data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
-        elif header['eval_board_mode'] == 13:
-            data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
-        else:
-            data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
-        data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
-
-        # Check for gaps in timestamps.
-        num_gaps = np.sum(np.not_equal(data['t_amplifier'][1:]-data['t_amplifier'][:-1], 1))
-        if num_gaps == 0:
-            print('No missing timestamps in data.')
-        else:
-            print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
-
-        # Scale time steps (units = seconds).
-        data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
-        data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
-        data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
-        data['t_board_adc'] = data['t_amplifier']
-        data['t_dig'] = data['t_amplifier']
-        data['t_temp_sensor'] = data['t_supply_voltage']
+        if dtype is None:
+            # by default, this script interprets digital events (digital inputs and outputs) as booleans
+            # if unsigned int values are preferred(0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
+            # the commented line below illustrates this for digital input data; the same can be done for digital out
+            num_board_dig_in_samples = len(data['board_dig_in_raw'])
+            num_board_dig_out_samples = len(data['board_dig_out_raw'])
+
+            #data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
+            data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.bool)
+            data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.bool)
+
+            # Extract digital input channels to separate variables.
+            for i in range(header['num_board_dig_in_channels']):
+                data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
+
+            # Extract digital output channels to separate variables.
+            for i in range(header['num_board_dig_out_channels']):
+                data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
+
+            # Scale voltage levels appropriately.
+            data['amplifier_data'] = np.multiply(0.195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = microvolts
+            data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
+            data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
+            if header['eval_board_mode'] == 1:
+                data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
+            elif header['eval_board_mode'] == 13:
+                data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
+            else:
+                data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
+            data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
 
         # If the software notch filter was selected during the recording, apply the
         # same notch filter to amplifier data here.   Commented out by AE; do not want to apply notch filter, whether applied during recording or not
@@ -182,8 +81,6 @@ def read_data(filename):
                 # if fraction_done >= percent_done:
                     # print('{}% done...'.format(percent_done))
                     # percent_done += print_increment
-    else:
-        data = [];
 
     # Move variables to result struct.
     result = data_to_result(header, data, data_present)
@@ -191,14 +88,210 @@ def read_data(filename):
     print('Done!  Elapsed time: {0:0.1f} seconds'.format(time.time() - tic))
     return result
 
-def plural(n):
-    """Utility function to optionally pluralize words based on the value of n.
+def iter_chunks(filename, blocks_per_chunk=1000, channels=None, streams=None):
+    """Iterates over an Intan Technologies RHD2000 data file in chunks of whole data blocks.
+
+    Yields one dictionary per chunk, in file order, holding at most blocks_per_chunk data
+    blocks, so peak memory is bounded by the chunk size rather than the file size.  Each
+    chunk uses the same keys as the data read by read_data ('t_amplifier', 'amplifier_data',
+    'aux_input_data', 'supply_voltage_data', 'temp_sensor_data', 'board_adc_data',
+    'board_dig_in_raw', 'board_dig_out_raw') plus 'first_sample', the amplifier sample
+    index of the start of the chunk, and 'timestamp_gaps', the gaps found in the chunk
+    (including at its start) as (sample, expected, actual) rows.  Samples are left as the unscaled integers stored in
+    the file.  channels and streams restrict decoding as in read_data.
+    """
+
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        header = read_header(fid, quiet=True)
+
+        bytes_per_block = get_bytes_per_data_block(header)
+        bytes_remaining = filesize - fid.tell()
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = int(bytes_remaining / bytes_per_block)
+
+        block_dtype = get_data_block_dtype(header)
+        first_block = 0
+        previous = None
+        while first_block < num_data_blocks:
+            count = min(blocks_per_chunk, num_data_blocks - first_block)
+            blocks = np.fromfile(fid, dtype=block_dtype, count=count)
+            if blocks.shape[0] != count:
+                raise Exception('Error: End of file reached before all data blocks were read.')
+
+            chunk = data_blocks_to_arrays(blocks, header, channels, streams)
+            chunk['first_sample'] = first_block * header['num_samples_per_data_block']
+            chunk['timestamp_gaps'] = find_timestamp_gaps(chunk['t_amplifier'], previous, chunk['first_sample'])
+            previous = chunk['t_amplifier'][-1]
+            first_block += count
+            yield chunk
+
+def follow_chunks(filename, poll_interval=0.5, idle_timeout=None, blocks_per_chunk=1000, channels=None, streams=None):
+    """Follows an RHD2000 data file that is still being written, yielding data blocks as they are completed.
+
+    The file size is polled every poll_interval seconds; each poll decodes only the whole
+    data blocks appended since the last one (a partly written block waits for the next
+    poll) and yields them as chunks of at most blocks_per_chunk blocks, with the same keys
+    as the chunks from iter_chunks.  The header may itself still be being written when
+    following starts.  Following stops once no new block has appeared for idle_timeout
+    seconds; with idle_timeout None it continues until the caller stops iterating.
+    """
+
+    last_change = time.monotonic()
+
+    def idle():
+        if idle_timeout is not None and time.monotonic() - last_change > idle_timeout:
+            return True
+        time.sleep(poll_interval)
+        return False
+
+    with open(filename, 'rb') as fid:
+        # Wait for a complete header.
+        read_size = HEADER_READ_SIZE
+        while True:
+            fid.seek(0)
+            buffer = fid.read(read_size)
+            try:
+                header, data_offset = parse_header(buffer)
+                break
+            except HeaderTruncated:
+                if len(buffer) == read_size:
+                    read_size *= 2
+                elif idle():
+                    return
+
+        bytes_per_block = int(get_bytes_per_data_block(header))
+        block_dtype = get_data_block_dtype(header)
+        num_blocks_read = 0
+        previous = None
+        while True:
+            num_data_blocks = (os.fstat(fid.fileno()).st_size - data_offset) // bytes_per_block
+            if num_data_blocks <= num_blocks_read:
+                if idle():
+                    return
+                continue
+            last_change = time.monotonic()
+
+            fid.seek(data_offset + num_blocks_read * bytes_per_block)
+            while num_blocks_read < num_data_blocks:
+                count = min(blocks_per_chunk, num_data_blocks - num_blocks_read)
+                blocks = np.fromfile(fid, dtype=block_dtype, count=count)
+                if blocks.shape[0] != count:
+                    raise Exception('Error: End of file reached before all data blocks were read.')
+
+                chunk = data_blocks_to_arrays(blocks, header, channels, streams)
+                chunk['first_sample'] = num_blocks_read * header['num_samples_per_data_block']
+                chunk['timestamp_gaps'] = find_timestamp_gaps(chunk['t_amplifier'], previous, chunk['first_sample'])
+                previous = chunk['t_amplifier'][-1]
+                num_blocks_read += count
+                yield chunk
+
+def read_range_samples(filename, start, stop, channels=None, streams=None):
+    """Reads amplifier samples start to stop (exclusive) of an RHD2000 data file.
+
+    Sample indices count from the first sample in the file.  Only the data blocks that
+    overlap the range are read, by seeking straight to their offset.  Returns a dictionary
+    with the same keys as the chunks from iter_chunks, with amplifier-rate streams trimmed
+    to the range, aux inputs to the aux samples overlapping it and supply voltage and
+    temperature holding one sample per overlapping block.
+    """
+
+    with open(filename, 'rb') as fid:
+        header, data_offset, num_data_blocks = locate_data_blocks(fid)
+        return read_sample_range(fid, header, data_offset, num_data_blocks, start, stop, channels, streams)
+
+
+def read_range(filename, t_start, t_stop, channels=None, streams=None):
+    """Reads the samples with t_start <= t < t_stop (in seconds) of an RHD2000 data file.
+
+    Times are on the same clock as t_amplifier from read_data, i.e. timestamp / sample rate,
+    so files whose timestamps do not start at zero (or that contain gaps) are handled.  The
+    samples are located by bisecting on the first timestamp of each data block, which only
+    reads a few bytes per step.  Returns the same dictionary as read_range_samples.
     """
 
-    if n == 1:
-        return ''
-    else:
-        return 's'
+    with open(filename, 'rb') as fid:
+        header, data_offset, num_data_blocks = locate_data_blocks(fid)
+        fs = header['sample_rate']
+        start = timestamp_to_sample(fid, header, data_offset, num_data_blocks, int(math.ceil(round(t_start * fs, 6))))
+        stop = timestamp_to_sample(fid, header, data_offset, num_data_blocks, int(math.ceil(round(t_stop * fs, 6))))
+        return read_sample_range(fid, header, data_offset, num_data_blocks, start, stop, channels, streams)
+
+
+def locate_data_blocks(fid):
+    """Reads the header from fid and returns it with the data-region offset and number of whole data blocks."""
+
+    header = read_header(fid, quiet=True)
+    data_offset = fid.tell()
+    bytes_per_block = get_bytes_per_data_block(header)
+    num_data_blocks = int((os.fstat(fid.fileno()).st_size - data_offset) // bytes_per_block)
+    return header, data_offset, num_data_blocks
+
+
+def timestamp_to_sample(fid, header, data_offset, num_data_blocks, timestamp):
+    """Returns the index of the first sample whose timestamp is at least timestamp."""
+
+    bytes_per_block = get_bytes_per_data_block(header)
+    n = header['num_samples_per_data_block']
+    timestamp_dtype = get_data_block_dtype(header)['timestamps'].base
+
+    def first_timestamp(block):
+        fid.seek(int(data_offset + block * bytes_per_block))
+        return np.frombuffer(fid.read(4), dtype=timestamp_dtype)[0]
+
+    # Find the last block starting at or before timestamp.
+    lo, hi = 0, num_data_blocks
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if first_timestamp(mid) <= timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    block = lo - 1
+    if block < 0:
+        return 0
+
+    fid.seek(int(data_offset + block * bytes_per_block))
+    timestamps = np.frombuffer(fid.read(4 * n), dtype=timestamp_dtype)
+    return block * n + int(np.searchsorted(timestamps, timestamp))
+
+
+def read_sample_range(fid, header, data_offset, num_data_blocks, start, stop, channels=None, streams=None):
+    """Decodes amplifier samples start to stop from fid; see read_range_samples."""
+
+    n = header['num_samples_per_data_block']
+    start = min(max(int(start), 0), n * num_data_blocks)
+    stop = min(max(int(stop), start), n * num_data_blocks)
+    first_block = start // n
+    last_block = -(-stop // n) if stop > start else first_block
+
+    block_dtype = get_data_block_dtype(header)
+    lo = start - first_block * n
+    hi = stop - first_block * n
+
+    # The timestamp of the sample before start, so a gap right at start is found too.
+    previous = None
+    if start > 0 and stop > start and lo == 0:
+        timestamp_dtype = block_dtype['timestamps'].base
+        fid.seek(int(data_offset + (first_block - 1) * block_dtype.itemsize + (n - 1) * timestamp_dtype.itemsize))
+        previous = np.frombuffer(fid.read(timestamp_dtype.itemsize), dtype=timestamp_dtype)[0]
+
+    fid.seek(int(data_offset + first_block * block_dtype.itemsize))
+    blocks = np.fromfile(fid, dtype=block_dtype, count=last_block - first_block)
+    data = data_blocks_to_arrays(blocks, header, channels, streams)
+
+    if lo > 0 and stop > start:
+        previous = data['t_amplifier'][lo - 1]
+    data['t_amplifier'] = data['t_amplifier'][lo:hi]
+    data['amplifier_data'] = data['amplifier_data'][:, lo:hi]
+    data['board_adc_data'] = data['board_adc_data'][:, lo:hi]
+    data['board_dig_in_raw'] = data['board_dig_in_raw'][lo:hi]
+    data['board_dig_out_raw'] = data['board_dig_out_raw'][lo:hi]
+    data['aux_input_data'] = data['aux_input_data'][:, lo // 4:-(-hi // 4)]
+    data['first_sample'] = start
+    data['timestamp_gaps'] = find_timestamp_gaps(data['t_amplifier'], previous, start)
+    return data
 
 if __name__ == '__main__':
     a=read_data(sys.argv[1])
@@ -0,0 +1,21 @@
+import numpy as np
+import scipy.signal as signal
+
+import read_rhd
+
+
+def test_notch_filter_channels_in_place_small_chunks():
+    """Filtering x into itself in chunks shorter than the filter overlap matches filtfilt."""
+
+    fs, f_notch = 20000.0, 60.0
+    rng = np.random.RandomState(0)
+    t = np.arange(60000) / fs
+    x = np.sin(2 * np.pi * f_notch * t) + 0.1 * rng.standard_normal([3, len(t)])
+
+    b, a = read_rhd.design_notch_filter(f_notch / (fs / 2.0), 10)
+    expected = signal.filtfilt(b, a, x, axis=1, padlen=150)
+
+    for chunk_size in (7777, 30000):
+        y = x.copy()
+        read_rhd.notch_filter_channels(y, fs, f_notch, out=y, chunk_size=chunk_size, num_workers=2)
+        assert np.max(np.abs(y - expected)) < 1e-6